@@ -2,27 +2,54 @@ import pandas as pd
 import os
 import logging
 import json
-from openai import OpenAI
+from llm_cache import CachedChatClient
+from llm_gateway import get_gateway
+from abstract_retriever import get_index
+from batching import make_batches
+from query_cache import QueryResultCache, normalize_query, corpus_version
+from model_router import ModelRouter, LowConfidence, VALIDATION_ERRORS
 from tqdm import tqdm
 import concurrent.futures
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+QUERY_EXPANSION_PROMPT = """
+        The user wants to find research papers about the topic below. The paper abstracts are written in English.
+        List English search keywords for this topic: translations of the topic, common synonyms, abbreviations and closely related technical terms.
+        Respond with the keywords only, separated by commas, at most 15 keywords.
+        """
+
+BATCH_MATCH_PROMPT = """
+        You will receive a user query and several paper abstracts. Each abstract starts with a line "### Abstract <id>".
+        Decide for every abstract whether it is relevant to the user query.
+        Respond with a JSON object of the form {"matches": ["A1", "A3"], "uncertain": ["A2"]}.
+        "matches" lists the ids of all relevant abstracts (an empty list if none are relevant); "uncertain" lists the ids you cannot decide confidently (usually an empty list).
+        """
+
 class AbstractMatcher:
-    def __init__(self, model="gpt-4o"):
+    def __init__(self, model="gpt-4o", query_cache=None, fast_model=None, cascade=None):
         """
         初始化摘要匹配器
         
         参数:
             model: 使用的OpenAI模型名称
+            query_cache: 查询结果缓存，为None时使用默认路径的QueryResultCache，为False时不使用缓存
+            fast_model: 级联模式下先尝试的小模型，为None时使用model_router.STAGE_MODELS中的配置
+            cascade: 是否开启级联（小模型输出不合法或不确定时再用model），为None时使用默认配置
         """
         self.api_key = os.environ.get("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("请提供OpenAI API密钥或设置OPENAI_API_KEY环境变量")
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.model = model
+        self.client = CachedChatClient(get_gateway())
+        self.router = ModelRouter("abstract_matching", model, fast_model, cascade)
+        self.model = self.router.model
+        # 查询结果缓存按实际参与判断的模型组合区分
+        self.verdict_model = ">".join(self.router.models())
+        if query_cache is None:
+            query_cache = QueryResultCache()
+        self.query_cache = query_cache or None
     
     def load_abstracts(self, csv_path):
         """
@@ -43,31 +70,45 @@ class AbstractMatcher:
             if "Abstract" not in df.columns:
                 raise ValueError("CSV文件中不存在Abstract列")
             
-            # 创建索引-摘要字典
-            abstracts_dict = {}
-            for i, row in enumerate(df.itertuples()):
-                abstract = getattr(row, "Abstract", "")
-                if abstract and abstract != "Error":
-                    abstracts_dict[i] = abstract
-            
-            logging.info(f"成功加载{len(abstracts_dict)}条有效摘要")
-            return abstracts_dict
+            return self.abstracts_from_column(df["Abstract"])
         
         except Exception as e:
             logging.error(f"加载摘要失败: {str(e)}")
             raise
     
-    def match_single_abstract(self, index, abstract, query):
+    def load_paper_ids(self, csv_path):
+        """读取CSV文件中的论文ID列，用于查询结果缓存；没有该列时返回None"""
+        df = pd.read_csv(csv_path, usecols=lambda column: column == "Paper_ID", dtype=str)
+        return df["Paper_ID"].tolist() if "Paper_ID" in df.columns else None
+    
+    def abstracts_from_column(self, abstracts):
         """
-        判断单个摘要是否与查询匹配
+        将摘要列转换为索引-摘要字典，跳过空摘要
         
         参数:
-            index: 摘要索引
-            abstract: 摘要内容
-            query: 用户查询
+            abstracts: 摘要列（按论文顺序）
+            
         返回:
-            如果匹配返回索引，否则返回None
+            包含索引和摘要的字典
         """
+        abstracts_dict = {}
+        for i, abstract in enumerate(abstracts):
+            if isinstance(abstract, str) and abstract and abstract != "Error":
+                abstracts_dict[i] = abstract
+        
+        logging.info(f"成功加载{len(abstracts_dict)}条有效摘要")
+        return abstracts_dict
+    
+    def request_single_match(self, abstract, query):
+        """
+        判断单个摘要是否与查询匹配（级联模式下先用小模型），调用失败时抛出异常
+        
+        返回:
+            是否匹配
+        """
+        return self.router.run(lambda model: self._request_single_match(abstract, query, model))
+    
+    def _request_single_match(self, abstract, query, model):
         prompt = f"""
         请分析以下论文摘要是否与用户查询相关:
         
@@ -75,31 +116,288 @@ class AbstractMatcher:
         
         用户查询: "{query}"
         
-        如果摘要与查询相关，请回答"是"；如果不相关，请回答"否"。
-        只返回"是"或"否"，不要添加任何额外文本。
+        如果摘要与查询相关，请回答"是"；如果不相关，请回答"否"；如果无法确定，请回答"不确定"。
+        只返回"是"、"否"或"不确定"，不要添加任何额外文本。
+        """
+        
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.0
+        )
+        
+        result = response.choices[0].message.content.strip().lower()
+        if model != self.router.model:
+            if "不确定" in result:
+                raise LowConfidence("小模型无法确定摘要是否相关")
+            if not any(word in result for word in ("是", "否", "yes", "no")):
+                raise ValueError(f"无法解析的回答: {result}")
+        return "是" in result or "yes" in result
+    
+    def judge_single_abstract(self, index, abstract, query):
+        """
+        判断单个摘要是否与查询匹配
+        
+        返回:
+            是否匹配，调用失败时返回None（不应被缓存）
+        """
+        try:
+            return self.request_single_match(abstract, query)
+        except Exception as e:
+            logging.error(f"匹配摘要 {index} 失败: {str(e)}")
+            return None
+    
+    def match_single_abstract(self, index, abstract, query):
+        """
+        判断单个摘要是否与查询匹配
+        
+        参数:
+            index: 摘要索引
+            abstract: 摘要内容
+            query: 用户查询
+        返回:
+            如果匹配返回索引，否则返回None
         """
+        return index if self.judge_single_abstract(index, abstract, query) else None
+    
+    def expand_query(self, query):
+        """
+        用一次模型调用把查询扩展为英文关键词（中文查询需要翻译后才能检索英文摘要）
         
+        返回:
+            原查询加上扩展关键词，调用失败时返回原查询
+        """
         try:
+            # 关键词扩展只用于本地检索，使用级联中最便宜的模型
             response = self.client.chat.completions.create(
-                model=self.model,
+                model=self.router.models()[0],
                 messages=[
-                    {"role": "user", "content": prompt}
+                    {"role": "system", "content": QUERY_EXPANSION_PROMPT},
+                    {"role": "user", "content": query}
                 ],
                 temperature=0.0
             )
+            keywords = response.choices[0].message.content.strip()
+            logging.info(f"查询扩展: {query} -> {keywords}")
+            return f"{query} {keywords}"
+        except Exception as e:
+            logging.warning(f"查询扩展失败，使用原查询检索: {str(e)}")
+            return query
+    
+    def retrieve_candidates(self, abstracts_dict, query, top_k=50, expand=True):
+        """
+        用本地BM25检索挑出最可能相关的摘要，只把这些摘要交给模型确认
+        
+        参数:
+            abstracts_dict: 索引-摘要字典
+            query: 用户查询
+            top_k: 最多保留的候选数
+            expand: 是否先扩展查询关键词
+            
+        返回:
+            候选的索引-摘要字典；检索不到任何候选时返回全部摘要
+        """
+        index = get_index(abstracts_dict)
+        search_query = self.expand_query(query) if expand else query
+        hits = index.search(search_query, top_k)
+        if not hits:
+            logging.warning("本地检索没有找到候选摘要，退回逐条判断全部摘要")
+            return abstracts_dict
+        logging.info(f"本地检索从{len(abstracts_dict)}条摘要中选出{len(hits)}条候选")
+        return {key: abstracts_dict[key] for key, _ in hits}
+    
+    def match_many(self, abstracts_dict, query, max_workers=5):
+        """
+        并行逐条判断摘要是否与查询匹配
+        
+        返回:
+            索引到是否匹配的字典，判断失败的摘要对应None
+        """
+        verdicts = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 创建未来任务
+            future_to_index = {
+                executor.submit(
+                    self.judge_single_abstract, 
+                    index, 
+                    abstract, 
+                    query
+                ): index 
+                for index, abstract in abstracts_dict.items()
+            }
             
-            result = response.choices[0].message.content.strip().lower()
+            # 处理完成的任务
+            for future in tqdm(concurrent.futures.as_completed(future_to_index), 
+                              total=len(abstracts_dict), 
+                              desc="匹配摘要"):
+                verdicts[future_to_index[future]] = future.result()
+        return verdicts
+    
+    def match_abstracts(self, abstracts_dict, query, max_workers=5, top_k=50, batched=True, batch_size=20, token_budget=12000, paper_ids=None):
+        """
+        并行判断每条摘要是否与查询匹配
+        
+        参数:
+            abstracts_dict: 索引-摘要字典
+            query: 用户查询
+            max_workers: 并行处理的最大工作线程数
+            top_k: 本地检索保留的候选数，为None时不做检索，逐条判断全部摘要
+            batched: 是否把多条摘要打包到一个请求中判断
+            batch_size: 批量模式下每批最多的摘要数
+            token_budget: 批量模式下每批摘要的token上限
+            paper_ids: 按索引排列的论文ID，提供时使用查询结果缓存
             
-            if "是" in result or "yes" in result:
-                return index
-            else:
-                return None
+        返回:
+            匹配结果（索引数组）
+        """
+        use_cache = self.query_cache is not None and paper_ids is not None
+        known = {}
+        if use_cache:
+            query_key = normalize_query(query)
+            index_to_id = {index: str(paper_ids[index]) for index in abstracts_dict}
+            corpus = corpus_version(index_to_id.values(), f"top_k={top_k}")
+            cached = self.query_cache.get_result(self.verdict_model, query_key, corpus)
+            if cached is not None:
+                id_to_index = {paper_id: index for index, paper_id in index_to_id.items()}
+                logging.info(f"查询结果缓存命中，直接返回{len(cached)}条匹配结果")
+                return sorted(id_to_index[paper_id] for paper_id in cached if paper_id in id_to_index)
+            # 语料有重叠时复用之前对同一查询的逐篇判断
+            known = self.query_cache.get_verdicts(self.verdict_model, query_key, index_to_id.values())
+            if known:
+                logging.info(f"复用了{len(known)}篇论文对该查询的判断结果")
+        
+        candidates = abstracts_dict
+        if top_k is not None and len(abstracts_dict) > top_k:
+            candidates = self.retrieve_candidates(abstracts_dict, query, top_k)
+        pending = {index: abstract for index, abstract in candidates.items()
+                   if not use_cache or index_to_id[index] not in known}
+        
+        if not pending:
+            verdicts = {}
+        elif batched:
+            verdicts = self.match_many_batched(pending, query, max_workers, batch_size, token_budget)
+        else:
+            verdicts = self.match_many(pending, query, max_workers)
+        matched_indices = {index for index, matched in verdicts.items() if matched}
+        
+        if use_cache:
+            matched_indices.update(index for index, paper_id in index_to_id.items() if known.get(paper_id))
+            self.query_cache.put_verdicts(self.verdict_model, query_key, {
+                index_to_id[index]: matched for index, matched in verdicts.items() if matched is not None
+            })
+            # 有判断失败的摘要时不缓存完整结果，下次只重新判断这些摘要
+            if all(matched is not None for matched in verdicts.values()):
+                self.query_cache.put_result(self.verdict_model, query_key, corpus,
+                                            [index_to_id[index] for index in sorted(matched_indices)])
+        
+        logging.info(f"成功匹配摘要，找到{len(matched_indices)}条匹配结果")
+        return sorted(matched_indices)
+    
+    def request_batch_match(self, batch, query):
+        """
+        在一个请求中判断一批摘要是否与查询匹配，输出不合法时抛出ValueError
+        
+        参数:
+            batch: 索引-摘要字典
+            query: 用户查询
+            
+        返回:
+            索引到是否匹配的字典
+        """
+        return self.router.run(lambda model: self._request_batch_match(batch, query, model))
+    
+    def _request_batch_match(self, batch, query, model):
+        labels = {f"A{i + 1}": index for i, index in enumerate(batch)}
+        abstracts = "\n\n".join(f"### Abstract {label}\n{batch[index]}" for label, index in labels.items())
+        
+        request = dict(
+            model=model,
+            messages=[
+                {"role": "system", "content": BATCH_MATCH_PROMPT},
+                {"role": "user", "content": f"用户查询: \"{query}\"\n\n{abstracts}"}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.0
+        )
+        response = self.client.chat.completions.create(**request)
+        try:
+            return self._parse_batch_match(response.choices[0].message.content, labels, model)
+        except LowConfidence:
+            raise
+        except VALIDATION_ERRORS as e:
+            # 不合法的回答不能留在缓存中，否则每次查询都会重放并再次拆分
+            self.client.chat.completions.invalidate(**request)
+            if isinstance(e, ValueError):
+                raise
+            raise ValueError(f"批量匹配结果不合法: {str(e)}") from e
+    
+    def _parse_batch_match(self, content, labels, model):
+        result = json.loads(content)
+        matches = result.get("matches") if isinstance(result, dict) else None
+        if not isinstance(matches, list) or not set(map(str, matches)) <= set(labels):
+            raise ValueError(f"批量匹配结果不合法: {result}")
+        uncertain = result.get("uncertain") or []
+        if model != self.router.model and uncertain:
+            raise LowConfidence(f"小模型无法确定{len(uncertain)}条摘要")
+        # 大模型仍不确定的摘要按不相关处理
+        matched = set(map(str, matches)) - set(map(str, uncertain))
+        return {index: label in matched for label, index in labels.items()}
+    
+    def match_batch(self, batch, query):
+        """
+        判断一批摘要；结果校验失败时拆成两半分别重试，单条时退回逐条判断，
+        接口错误时整批判断失败
+        
+        返回:
+            索引到是否匹配的字典，判断失败的摘要对应None
+        """
+        if len(batch) == 1:
+            index, abstract = next(iter(batch.items()))
+            return {index: self.judge_single_abstract(index, abstract, query)}
         
+        try:
+            return self.request_batch_match(batch, query)
+        except ValueError as e:
+            # 只有输出校验失败时才拆分；接口错误拆分后只会更多地失败
+            logging.warning(f"批量匹配{len(batch)}条摘要的结果不合法，拆分后重试: {str(e)}")
+            indices = list(batch)
+            middle = len(indices) // 2
+            result = self.match_batch({index: batch[index] for index in indices[:middle]}, query)
+            result.update(self.match_batch({index: batch[index] for index in indices[middle:]}, query))
+            return result
         except Exception as e:
-            logging.error(f"匹配摘要 {index} 失败: {str(e)}")
-            return None
+            logging.error(f"批量匹配{len(batch)}条摘要的API调用失败: {str(e)}")
+            return {index: None for index in batch}
+    
+    def match_many_batched(self, abstracts_dict, query, max_workers=5, batch_size=20, token_budget=12000):
+        """
+        按token预算把摘要打包成批量请求并行判断
+        
+        参数:
+            abstracts_dict: 索引-摘要字典
+            query: 用户查询
+            max_workers: 并行请求的批次数
+            batch_size: 每批最多的摘要数
+            token_budget: 每批摘要的token上限
+            
+        返回:
+            索引到是否匹配的字典
+        """
+        batches = make_batches(abstracts_dict, token_budget, batch_size)
+        logging.info(f"{len(abstracts_dict)}条摘要打包为{len(batches)}个批量匹配请求")
+        verdicts = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.match_batch, batch, query) for batch in batches]
+            with tqdm(total=len(abstracts_dict), desc="批量匹配摘要") as progress:
+                for future in concurrent.futures.as_completed(futures):
+                    batch_result = future.result()
+                    verdicts.update(batch_result)
+                    progress.update(len(batch_result))
+        return verdicts
     
-    def process_csv(self, csv_path, query, max_workers=5):
+    def process_csv(self, csv_path, query, max_workers=5, top_k=50, batched=True):
         """
         处理CSV文件，匹配摘要信息
         
@@ -107,6 +405,8 @@ class AbstractMatcher:
             csv_path: CSV文件路径
             query: 用户查询
             max_workers: 并行处理的最大工作线程数
+            top_k: 本地检索保留的候选数，为None时逐条判断全部摘要
+            batched: 是否把多条摘要打包到一个请求中判断
             
         返回:
             匹配结果（索引数组）
@@ -114,35 +414,36 @@ class AbstractMatcher:
         try:
             # 加载摘要
             abstracts_dict = self.load_abstracts(csv_path)
-            
-            # 使用线程池并行处理摘要
-            matched_indices = []
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 创建未来任务
-                future_to_index = {
-                    executor.submit(
-                        self.match_single_abstract, 
-                        index, 
-                        abstract, 
-                        query
-                    ): index 
-                    for index, abstract in abstracts_dict.items()
-                }
-                
-                # 处理完成的任务
-                for future in tqdm(concurrent.futures.as_completed(future_to_index), 
-                                  total=len(abstracts_dict), 
-                                  desc="匹配摘要"):
-                    result = future.result()
-                    if result is not None:
-                        matched_indices.append(result)
-            
-            logging.info(f"成功匹配摘要，找到{len(matched_indices)}条匹配结果")
-            return sorted(matched_indices)
+            paper_ids = self.load_paper_ids(csv_path)
+            return self.match_abstracts(abstracts_dict, query, max_workers, top_k, batched, paper_ids=paper_ids)
         
         except Exception as e:
             logging.error(f"处理CSV文件失败: {str(e)}")
             raise
+    
+    def process_store(self, store, query, max_workers=5, top_k=50, batched=True):
+        """
+        匹配论文存储中的摘要，只读取Paper_ID和Abstract列
+        
+        参数:
+            store: 论文存储（PaperStore）
+            query: 用户查询
+            max_workers: 并行处理的最大工作线程数
+            top_k: 本地检索保留的候选数，为None时逐条判断全部摘要
+            batched: 是否把多条摘要打包到一个请求中判断
+            
+        返回:
+            匹配结果（索引数组）
+        """
+        try:
+            df = store.read_columns(["Paper_ID", "Abstract"])
+            abstracts_dict = self.abstracts_from_column(df["Abstract"])
+            return self.match_abstracts(abstracts_dict, query, max_workers, top_k, batched,
+                                        paper_ids=df["Paper_ID"].tolist())
+        
+        except Exception as e:
+            logging.error(f"处理论文存储失败: {str(e)}")
+            raise
 
 def main():
     # 示例用法
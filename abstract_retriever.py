@@ -0,0 +1,149 @@
+import re
+import math
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+
+try:
+    import jieba
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:
+    jieba = None
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]")
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "by", "from", "as", "at",
+    "is", "are", "was", "were", "be", "been", "this", "that", "these", "those", "we", "our", "it",
+    "its", "which", "can", "such", "using", "based", "via", "into", "than", "also", "not", "their",
+    "paper", "propose", "proposed", "show", "results", "method", "approach",
+}
+
+
+def stem(word):
+    """极简的英文词干化，只去掉常见的复数和动词后缀，让 robot/robots/robotic 更容易对齐"""
+    for suffix in ("ations", "ation", "ings", "ing", "ies", "ics", "ic", "s", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def tokenize(text):
+    """
+    分词：英文按单词切分并词干化，中文有jieba时用jieba分词，否则切成单字和相邻两字
+
+    返回:
+        词语列表
+    """
+    if not isinstance(text, str):
+        return []
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if CJK_PATTERN.match(word):
+            if jieba is not None:
+                tokens.extend(w for w in jieba.lcut_for_search(word) if w.strip())
+            else:
+                tokens.extend(word)
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif word not in STOPWORDS and len(word) > 1:
+            tokens.append(stem(word))
+    return tokens
+
+
+class BM25Index:
+    """
+    摘要的BM25倒排索引：建立时为每个词预先计算好各文档的权重，
+    查询时用NumPy把查询词的权重累加到文档得分上
+    """
+    def __init__(self, documents, k1=1.5, b=0.75):
+        """
+        参数:
+            documents: 键（行号）到文本的字典
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.keys = list(documents)
+        tokenized = [tokenize(documents[key]) for key in self.keys]
+        lengths = np.array([len(tokens) for tokens in tokenized], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        norms = k1 * (1 - b + b * lengths / avg_length)
+
+        postings = {}
+        for doc, tokens in enumerate(tokenized):
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc)
+                postings[term][1].append(tf)
+
+        n = len(self.keys)
+        self.postings = {}
+        for term, (docs, tfs) in postings.items():
+            docs = np.array(docs, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[term] = (docs, (idf * tfs * (k1 + 1) / (tfs + norms[docs])).astype(np.float32))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def scores(self, query):
+        """返回所有文档对查询的BM25得分"""
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                docs, weights = posting
+                scores[docs] += weights
+        return scores
+
+    def search(self, query, top_k=50):
+        """
+        检索与查询最相关的文档
+
+        返回:
+            按得分从高到低排列的 (键, 得分) 列表，只包含得分大于0的文档
+        """
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores > 0)
+        if top_k is not None and len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.keys[doc], float(scores[doc])) for doc in candidates]
+
+
+def corpus_fingerprint(documents):
+    """根据键和文本计算语料的指纹，用于复用已经建立的索引"""
+    digest = hashlib.sha256()
+    for key, text in documents.items():
+        digest.update(f"{key}\x00{text}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_index(documents, max_cached=4):
+    """
+    返回语料的BM25索引，同一语料只建立一次（进程内保留最近使用的几个索引）
+
+    参数:
+        documents: 键到文本的字典
+        max_cached: 最多保留的索引数
+    """
+    fingerprint = corpus_fingerprint(documents)
+    with _index_cache_lock:
+        index = _index_cache.get(fingerprint)
+        if index is not None:
+            _index_cache.move_to_end(fingerprint)
+            return index
+    index = BM25Index(documents)
+    logging.info(f"为{len(index)}条摘要建立了检索索引，共{len(index.postings)}个词")
+    with _index_cache_lock:
+        _index_cache[fingerprint] = index
+        while len(_index_cache) > max_cached:
+            _index_cache.popitem(last=False)
+    return index
@@ -0,0 +1,110 @@
+import re
+import time
+import logging
+import threading
+
+
+def parse_reset_seconds(value):
+    """
+    解析OpenAI的限流重置时间，例如 "1s"、"6m0s"、"250ms"
+
+    返回:
+        秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for number, unit in re.findall(r"([\d.]+)(ms|h|m|s)", str(value)):
+        matched = True
+        number = float(number)
+        total += {"ms": number / 1000, "s": number, "m": number * 60, "h": number * 3600}[unit]
+    return total if matched else None
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    自适应并发限制器（加性增、乘性减）：
+    请求成功时逐步提高并发，遇到429或限流响应头显示余量不足时减半并暂停
+    """
+    def __init__(self, initial=4, min_limit=1, max_limit=16):
+        """
+        参数:
+            initial: 初始并发数
+            min_limit: 最小并发数
+            max_limit: 最大并发数
+        """
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.active = 0
+        self.successes = 0
+        self.pause_until = 0.0
+        self.rate_limited_count = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """等待直到有空闲的并发槽位且不处于暂停期"""
+        with self.condition:
+            while True:
+                wait = self.pause_until - time.monotonic()
+                if wait <= 0 and self.active < self.limit:
+                    self.active += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def on_success(self):
+        """一轮（limit次）成功后并发数加一"""
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def on_rate_limited(self, retry_after=None):
+        """遇到429时并发数减半，并按Retry-After暂停"""
+        with self.condition:
+            self.rate_limited_count += 1
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.successes = 0
+            if retry_after:
+                self.pause_until = max(self.pause_until, time.monotonic() + retry_after)
+            logging.warning(f"触发限流，并发数降为{self.limit}，暂停{retry_after or 0:.1f}秒")
+
+    def observe_headers(self, headers):
+        """
+        根据OpenAI的限流响应头调整：剩余请求数不足当前并发数时，
+        降低并发并暂停到配额重置
+        """
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is None:
+            return
+        try:
+            remaining = int(remaining)
+        except ValueError:
+            return
+        with self.condition:
+            if remaining < self.limit:
+                self.limit = max(self.min_limit, remaining)
+                self.successes = 0
+                reset = parse_reset_seconds(headers.get("x-ratelimit-reset-requests"))
+                if remaining == 0 and reset:
+                    self.pause_until = max(self.pause_until, time.monotonic() + reset)
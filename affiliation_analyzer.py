@@ -2,25 +2,53 @@ import pandas as pd
 import os
 import logging
 import json
-from openai import OpenAI
+import concurrent.futures
+from llm_cache import CachedChatClient
+from llm_gateway import get_gateway
 from orgs import orgs
+from org_matcher import OrgMatcher
+from model_router import ModelRouter
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 复核单条争议机构的提示：给出第一轮结论和本地匹配到的名称，让模型检查结论而不是重新回答同一个问题
+VERIFY_ROW_PROMPT = """
+Affiliation information of a paper:
+{affiliation}
+
+Target organizations:
+{target_orgs}
+
+A first-pass analysis concluded that this paper {verdict} affiliated with one of the target organizations.
+A keyword matcher found these possible mentions of target organizations: {evidence}
+Keyword mentions can be false positives: "meta-learning" is not Meta, "XAI" may mean explainable AI, and a similar name may belong to a different organization. The first-pass analysis can also miss a target organization written in another form or language.
+
+Check the first-pass conclusion carefully. Is at least one author affiliation actually one of the target organizations?
+Answer only "yes" or "no".
+"""
+
 class AffiliationAnalyzer:
-    def __init__(self, model="gpt-4o"):
+    def __init__(self, model="gpt-4o", verification="targeted", fast_model=None, cascade=None):
         """
         初始化机构分析器
         
         参数:
             model: 使用的OpenAI模型名称
+            verification: 验证策略，"targeted"只复核与本地匹配结果不一致的行，
+                          "full"对整个列表做第二轮验证，"none"不验证
+            fast_model: 级联模式下第一轮分析先尝试的小模型，为None时使用model_router.STAGE_MODELS中的配置
+            cascade: 是否开启级联（小模型输出无法解析为索引列表时再用model），为None时使用默认配置
         """
         self.api_key = os.environ.get("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("请提供OpenAI API密钥或设置OPENAI_API_KEY环境变量")
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.model = model
+        self.client = CachedChatClient(get_gateway())
+        self.router = ModelRouter("affiliation_analysis", model, fast_model, cascade)
+        self.model = self.router.model
+        self.verification = verification
+        # 最近一次分析中被复核的行数
+        self.verified_count = 0
     
     def concatenate_affiliations(self, csv_path):
         """
@@ -41,26 +69,81 @@ class AffiliationAnalyzer:
             if "Affiliation" not in df.columns:
                 raise ValueError("CSV文件中不存在Affiliation列")
             
-            # 拼接机构字段
-            result = ""
-            for i, row in enumerate(df.itertuples()):
-                affiliation = getattr(row, "Affiliation", "")
-                if affiliation and affiliation != "Error":
-                    result += f"{i}.{affiliation}\n"
-            
-            return result
+            return self.concatenate_affiliation_column(df["Affiliation"])
         
         except Exception as e:
             logging.error(f"拼接机构字段失败: {str(e)}")
             raise
     
-    def analyze_affiliations(self, concatenated_str, target_orgs):
+    def concatenate_affiliation_column(self, affiliations):
+        """
+        将机构列拼接成"索引.机构"格式的字符串
+        
+        参数:
+            affiliations: 机构列（按论文顺序）
+            
+        返回:
+            拼接后的字符串
+        """
+        result = ""
+        for i, affiliation in enumerate(affiliations):
+            if isinstance(affiliation, str) and affiliation and affiliation != "Error":
+                result += f"{i}.{affiliation}\n"
+        return result
+    
+    @staticmethod
+    def parse_indices(result):
+        """解析模型返回的索引列表字符串，无法解析时返回空列表"""
+        # 解析结果字符串为数组
+        try:
+            indices = json.loads(result.replace("'", "\""))
+            if not isinstance(indices, list):
+                raise ValueError("索引必须是列表格式")
+            return indices
+        except json.JSONDecodeError:
+            # 尝试使用eval解析（不推荐，但作为备选）
+            try:
+                indices = eval(result)
+                if isinstance(indices, list):
+                    return indices
+                else:
+                    logging.error("解析结果不是列表格式")
+                    return []
+            except:
+                logging.error(f"无法解析结果: {result}")
+                return []
+    
+    @staticmethod
+    def parse_indices_strict(result):
+        """严格解析索引列表，不是整数列表时抛出ValueError"""
+        indices = json.loads(result)
+        if not isinstance(indices, list) or not all(isinstance(index, int) for index in indices):
+            raise ValueError(f"结果不是整数列表: {result}")
+        return indices
+    
+    def request_initial_analysis(self, initial_prompt, model):
+        """第一轮分析；级联的小模型输出无法严格解析时抛出ValueError"""
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "你是一个专业的数据分析助手，擅长从文本中提取和分析信息。"},
+                {"role": "user", "content": initial_prompt}
+            ],
+            temperature=0.0
+        )
+        result = response.choices[0].message.content.strip()
+        if model != self.router.model:
+            self.parse_indices_strict(result)
+        return result
+    
+    def analyze_affiliations(self, concatenated_str, target_orgs, verify=True):
         """
         分析拼接后的机构字符串，找出包含目标机构的索引
         
         参数:
             concatenated_str: 拼接后的机构字符串
             target_orgs: 目标机构列表
+            verify: 是否对整个列表做第二轮验证
             
         返回:
             包含目标机构的索引列表
@@ -85,17 +168,11 @@ class AffiliationAnalyzer:
         """
         
         try:
-            # 第一轮分析
-            initial_response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的数据分析助手，擅长从文本中提取和分析信息。"},
-                    {"role": "user", "content": initial_prompt}
-                ],
-                temperature=0.0
-            )
+            # 第一轮分析（级联模式下先用小模型）
+            initial_result = self.router.run(lambda model: self.request_initial_analysis(initial_prompt, model))
             
-            initial_result = initial_response.choices[0].message.content.strip()
+            if not verify:
+                return self.parse_indices(initial_result)
             
             # 构建验证提示
             verification_prompt = f"""
@@ -130,47 +207,220 @@ class AffiliationAnalyzer:
             final_result = verification_response.choices[0].message.content.strip()
             logging.info("完成两轮分析验证")
             
-            # 解析结果字符串为数组
-            try:
-                indices = json.loads(final_result.replace("'", "\""))
-                if not isinstance(indices, list):
-                    raise ValueError("索引必须是列表格式")
-                return indices
-            except json.JSONDecodeError:
-                # 尝试使用eval解析（不推荐，但作为备选）
-                try:
-                    indices = eval(final_result)
-                    if isinstance(indices, list):
-                        return indices
-                    else:
-                        logging.error("解析结果不是列表格式")
-                        return []
-                except:
-                    logging.error(f"无法解析结果: {final_result}")
-                    return []
+            return self.parse_indices(final_result)
         
         except Exception as e:
             logging.error(f"分析机构失败: {str(e)}")
             return []
     
-    def process_csv(self, csv_path, target_orgs):
+    @staticmethod
+    def shard_rows(rows, token_budget=2000):
+        """
+        按token预算把待分析的行切分成若干片
+        
+        参数:
+            rows: (原始索引, 机构字符串) 列表
+            token_budget: 每片机构文本的token上限（按4个字符一个token估计）
+            
+        返回:
+            分片列表，每片是 (原始索引, 机构字符串) 列表
+        """
+        shards = []
+        shard, shard_tokens = [], 0
+        for index, affiliation in rows:
+            tokens = len(affiliation) // 4 + 1
+            if shard and shard_tokens + tokens > token_budget:
+                shards.append(shard)
+                shard, shard_tokens = [], 0
+            shard.append((index, affiliation))
+            shard_tokens += tokens
+        if shard:
+            shards.append(shard)
+        return shards
+    
+    def analyze_shard(self, shard, target_orgs):
+        """
+        分析一个分片：分片内使用从0开始的局部索引，返回对应的原始索引
+        """
+        concatenated_str = "".join(f"{local}.{affiliation}\n" for local, (_, affiliation) in enumerate(shard))
+        indices = []
+        verify = self.verification == "full"
+        for local in self.analyze_affiliations(concatenated_str, target_orgs, verify=verify):
+            try:
+                local = int(local)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= local < len(shard):
+                indices.append(shard[local][0])
+        return indices
+    
+    def analyze_rows(self, rows, target_orgs, token_budget=2000, max_workers=4):
+        """
+        分片并行分析机构，结果按索引排序后合并，与分片完成顺序无关
+        
+        参数:
+            rows: (原始索引, 机构字符串) 列表
+            target_orgs: 目标机构列表
+            token_budget: 每片机构文本的token上限
+            max_workers: 并行分析的最大线程数
+            
+        返回:
+            包含目标机构的原始索引列表
+        """
+        shards = self.shard_rows(rows, token_budget)
+        if not shards:
+            logging.warning("没有需要分析的机构")
+            return []
+        logging.info(f"{len(rows)}条机构分为{len(shards)}片并行分析")
+        
+        indices = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for result in executor.map(lambda shard: self.analyze_shard(shard, target_orgs), shards):
+                indices.update(result)
+        return sorted(indices)
+    
+    def verify_disputed(self, rows, llm_indices, target_orgs, matcher, max_workers=4):
+        """
+        只复核大模型结果与本地宽松匹配信号不一致的行
+        
+        参数:
+            rows: 交给大模型分析的 (原始索引, 机构字符串) 列表
+            llm_indices: 大模型第一轮给出的原始索引集合
+            target_orgs: 目标机构列表
+            matcher: 本地机构匹配器
+            max_workers: 并行复核的最大线程数
+            
+        返回:
+            复核后的原始索引集合
+        """
+        disputed = [(index, affiliation) for index, affiliation in rows
+                    if matcher.loose_match(affiliation) != (index in llm_indices)]
+        self.verified_count = len(disputed)
+        logging.info(f"复核{len(disputed)}/{len(rows)}条与本地匹配结果不一致的机构")
+        if not disputed:
+            return set(llm_indices)
+        
+        # 逐条用是/否问题检查第一轮结论，提示中带上本地匹配到的名称作为证据
+        def verify(row):
+            index, affiliation = row
+            return index, self.verify_row(affiliation, index in llm_indices, matcher, target_orgs)
+        
+        result = set(llm_indices)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for index, matched in executor.map(verify, disputed):
+                if matched:
+                    result.add(index)
+                else:
+                    result.discard(index)
+        return result
+    
+    def verify_row(self, affiliation, first_pass, matcher, target_orgs):
+        """
+        复核一条机构的第一轮结论
+        
+        参数:
+            affiliation: 机构字符串
+            first_pass: 第一轮是否判断为目标机构
+            matcher: 本地机构匹配器，提供宽松匹配到的名称
+            target_orgs: 目标机构列表
+            
+        返回:
+            复核后是否为目标机构；复核失败或回答无法解析时保留第一轮结论
+        """
+        mentions = matcher.loose_matches(affiliation)
+        evidence = ", ".join(f'"{text}" (possible {name})' for text, name in mentions) or "none"
+        prompt = VERIFY_ROW_PROMPT.format(affiliation=affiliation, target_orgs=target_orgs,
+                                          verdict="is" if first_pass else "is not", evidence=evidence)
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "你是一个专业的数据分析助手，擅长从文本中提取和分析信息。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.0
+            )
+            answer = response.choices[0].message.content.strip().strip(".\"'").lower()
+        except Exception as e:
+            logging.error(f"复核机构失败，保留第一轮结论: {str(e)}")
+            return first_pass
+        if answer in ("yes", "no"):
+            return answer == "yes"
+        logging.warning(f"无法解析复核结果，保留第一轮结论: {answer}")
+        return first_pass
+    
+    def analyze_column(self, affiliations, target_orgs, use_local_matcher=True, sharded=True):
+        """
+        分析机构列，找出包含目标机构的索引
+        
+        参数:
+            affiliations: 机构列（按论文顺序）
+            target_orgs: 目标机构列表
+            use_local_matcher: 是否先用本地别名匹配器判断，只把无法确定的行交给大模型
+            sharded: 是否把交给大模型的行分片并行分析
+            
+        返回:
+            包含目标机构的索引列表
+        """
+        affiliations = list(affiliations)
+        valid = [i for i, affiliation in enumerate(affiliations)
+                 if isinstance(affiliation, str) and affiliation and affiliation != "Error"]
+        
+        if use_local_matcher:
+            matcher = OrgMatcher(target_orgs)
+            matched, ambiguous = matcher.match_rows(affiliations)
+            logging.info(f"本地匹配: {len(matched)}条命中，{len(ambiguous)}条需要模型判断，"
+                         f"{len(affiliations) - len(matched) - len(ambiguous)}条未命中")
+        else:
+            matched, ambiguous = [], valid
+        
+        llm_indices = []
+        self.verified_count = 0
+        if ambiguous:
+            rows = [(i, affiliations[i]) for i in ambiguous]
+            if sharded:
+                llm_indices = self.analyze_rows(rows, target_orgs)
+            else:
+                # 保留原始索引，模型返回的索引可以直接使用
+                concatenated_str = "".join(f"{i}.{affiliations[i]}\n" for i in ambiguous)
+                print(concatenated_str)
+                ambiguous_set = set(ambiguous)
+                verify = self.verification == "full"
+                for index in self.analyze_affiliations(concatenated_str, target_orgs, verify=verify):
+                    try:
+                        index = int(index)
+                    except (TypeError, ValueError):
+                        continue
+                    if index in ambiguous_set:
+                        llm_indices.append(index)
+            if self.verification == "targeted":
+                llm_indices = self.verify_disputed(rows, set(llm_indices), target_orgs, OrgMatcher(target_orgs))
+        
+        return sorted(set(matched) | set(llm_indices))
+    
+    def process_csv(self, csv_path, target_orgs, use_local_matcher=True, sharded=True):
         """
         处理CSV文件，分析机构信息
         
         参数:
             csv_path: CSV文件路径
             target_orgs: 目标机构列表
+            use_local_matcher: 是否先用本地别名匹配器判断
+            sharded: 是否分片并行分析
             
         返回:
             分析结果（索引数组）
         """
         try:
-            # 拼接机构字段
-            concatenated_str = self.concatenate_affiliations(csv_path)
-            logging.info("成功拼接机构字段")
-            print(concatenated_str)
+            df = pd.read_csv(csv_path)
+            logging.info(f"成功读取CSV文件，共{len(df)}条记录")
+            
+            # 检查是否存在Affiliation列
+            if "Affiliation" not in df.columns:
+                raise ValueError("CSV文件中不存在Affiliation列")
+            
             # 分析机构
-            result = self.analyze_affiliations(concatenated_str, target_orgs)
+            result = self.analyze_column(df["Affiliation"], target_orgs, use_local_matcher, sharded)
             logging.info("成功分析机构")
             print("分析结果:")
             print(result)
@@ -180,6 +430,32 @@ class AffiliationAnalyzer:
             logging.error(f"处理CSV文件失败: {str(e)}")
             raise
 
+    def process_store(self, store, target_orgs, use_local_matcher=True, sharded=True):
+        """
+        分析论文存储中的机构信息，只读取Affiliation列
+        
+        参数:
+            store: 论文存储（PaperStore）
+            target_orgs: 目标机构列表
+            use_local_matcher: 是否先用本地别名匹配器判断
+            sharded: 是否分片并行分析
+            
+        返回:
+            分析结果（索引数组）
+        """
+        try:
+            df = store.read_columns(["Affiliation"])
+            logging.info(f"成功读取论文存储，共{len(df)}条记录")
+            result = self.analyze_column(df["Affiliation"], target_orgs, use_local_matcher, sharded)
+            logging.info("成功分析机构")
+            print("分析结果:")
+            print(result)
+            return result
+        
+        except Exception as e:
+            logging.error(f"处理论文存储失败: {str(e)}")
+            raise
+
 def main():
     # 目标机构列表
     analyzer = AffiliationAnalyzer()
@@ -0,0 +1,135 @@
+import re
+import ast
+import json
+import logging
+from orgs import org_domains, webmail_domains
+
+# 单个邮箱，例如 alice@cs.stanford.edu
+EMAIL_PATTERN = re.compile(r"([\w.+-]+)\s?@\s?([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)")
+# 合并写法，例如 {alice, bob}@mit.edu
+GROUPED_EMAIL_PATTERN = re.compile(r"\{([^{}]+)\}\s?@\s?([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)")
+
+
+def count_authors(authors):
+    """
+    统计作者数量
+
+    参数:
+        authors: 作者列表，或CSV/数据库中保存的列表字符串（例如 "['A', 'B']"）
+
+    返回:
+        作者数量，无法判断时返回None
+    """
+    if isinstance(authors, (list, tuple)):
+        return len(authors)
+    if not isinstance(authors, str) or not authors.strip():
+        return None
+    try:
+        parsed = ast.literal_eval(authors)
+        if isinstance(parsed, (list, tuple)):
+            return len(parsed)
+    except (ValueError, SyntaxError):
+        pass
+    return len([name for name in authors.split(",") if name.strip()])
+
+
+class AffiliationResolver:
+    """
+    本地机构解析器：从论文第一页中提取作者邮箱，按内置的域名->机构索引确定机构，
+    只有全部作者的邮箱都能解析时才认为结果可信，其余论文仍交给大模型分类
+    """
+    def __init__(self, domains=None, index_path=None):
+        """
+        参数:
+            domains: 域名到机构名称的字典，为None时使用orgs.org_domains
+            index_path: 额外的域名索引JSON文件（例如从ROR数据导出的 {"域名": "机构名称"}）
+        """
+        self.domains = {k.lower(): v for k, v in (org_domains if domains is None else domains).items()}
+        if index_path:
+            with open(index_path, "r", encoding="utf-8") as f:
+                extra = json.load(f)
+            self.domains.update({k.lower(): v for k, v in extra.items()})
+            logging.info(f"加载了{len(extra)}条额外的域名索引")
+        self.resolved_count = 0
+        self.unresolved_count = 0
+
+    @staticmethod
+    def extract_addresses(text):
+        """
+        提取文本中的邮箱地址
+
+        返回:
+            (用户名, 域名) 的列表，合并写法会展开为多个地址
+        """
+        if not isinstance(text, str) or "@" not in text:
+            return []
+        addresses = []
+        for names, domain in GROUPED_EMAIL_PATTERN.findall(text):
+            for name in re.split(r"[,;|\s]+", names):
+                if name:
+                    addresses.append((name, domain.lower().rstrip(".")))
+        # 合并写法已经处理过，去掉后再匹配单个邮箱
+        remaining = GROUPED_EMAIL_PATTERN.sub(" ", text)
+        for name, domain in EMAIL_PATTERN.findall(remaining):
+            addresses.append((name, domain.lower().rstrip(".")))
+        return list(dict.fromkeys(addresses))
+
+    def resolve_domain(self, domain):
+        """按域名后缀查找机构，例如 cs.stanford.edu -> stanford.edu"""
+        parts = domain.lower().split(".")
+        for i in range(len(parts) - 1):
+            org = self.domains.get(".".join(parts[i:]))
+            if org is not None:
+                return org
+        return None
+
+    def resolve(self, text, author_count=None):
+        """
+        根据邮箱解析一篇论文的机构
+
+        参数:
+            text: 论文第一页文本或作者信息块
+            author_count: 作者数量，邮箱数量少于作者数时不认为结果可信
+
+        返回:
+            机构列表字符串（与大模型分类的输出格式一致），无法可信解析时返回None
+        """
+        addresses = self.extract_addresses(text)
+        if not addresses:
+            return None
+        # 只有部分作者留了邮箱时，其他作者的机构可能不同
+        if author_count is None or len(addresses) < author_count:
+            return None
+
+        organizations = []
+        for _, domain in addresses:
+            if domain in webmail_domains:
+                return None
+            org = self.resolve_domain(domain)
+            if org is None:
+                return None
+            if org not in organizations:
+                organizations.append(org)
+        return json.dumps(organizations, ensure_ascii=False)
+
+    def resolve_many(self, papers):
+        """
+        批量解析论文机构
+
+        参数:
+            papers: 键到 (文本, 作者数量) 的字典
+
+        返回:
+            (键到机构字符串的字典, 未能解析的键列表)
+        """
+        resolved, unresolved = {}, []
+        for key, (text, author_count) in papers.items():
+            affiliation = self.resolve(text, author_count)
+            if affiliation is None:
+                unresolved.append(key)
+            else:
+                resolved[key] = affiliation
+        self.resolved_count += len(resolved)
+        self.unresolved_count += len(unresolved)
+        logging.info(f"根据作者邮箱解析了{len(resolved)}篇论文的机构，{len(unresolved)}篇交给大模型分类")
+        return resolved, unresolved
@@ -1,12 +1,16 @@
 import streamlit as st
 import datetime as dt
-import pandas as pd
 from arxiv_pdf import fetch_papers
 from paper_affiliation_classifier import PaperAffiliationClassifier
 from paper_assistant import PaperAssistant
 import affiliation_analyzer
 from abstract_matcher import AbstractMatcher
 from orgs import orgs
+from paper_store import PaperStore
+from llm_cache import get_default_cache
+from model_router import log_stage_stats
+from llm_gateway import get_gateway
+from priority_scheduler import get_scheduler
 from tools import clean_folder, is_pipeline_running, start_pipeline_background
 from output_file_format_manager import (
     get_download_link, get_binary_file_downloader_html, 
@@ -91,7 +95,7 @@ def main():
             st.info("步骤1/4: 从arXiv获取论文...")
             progress_bar.progress(10)
             
-            csv_filename = "papers.csv"
+            store = PaperStore("papers.db")
             pdf_folder = "pdf_folder"
             
             # 构建查询字符串
@@ -101,11 +105,11 @@ def main():
             start_date = end_date - dt.timedelta(days=days_back)
             papers_count = fetch_papers(
                 pdf_folder, 
-                csv_filename=csv_filename,
                 query=query,
                 author_filter=False,
                 start_date=start_date,
-                end_date=end_date
+                end_date=end_date,
+                store=store
             )
             
             if papers_count == 0:
@@ -113,7 +117,7 @@ def main():
                 return
             
             classifier = PaperAffiliationClassifier()
-            classifier.process_csv(csv_filename)
+            classifier.process_store(store, batched=True)
             
             progress_bar.progress(30)
             
@@ -122,7 +126,7 @@ def main():
             if target_orgs:
                 st.info("步骤2/4: 模型筛选目标机构论文...")
                 analyzer = affiliation_analyzer.AffiliationAnalyzer()
-                indices_result = analyzer.process_csv(csv_filename, target_orgs)
+                indices_result = analyzer.process_store(store, target_orgs)
                 progress_bar.progress(50)
             
             # 第三步：根据关键词过滤论文
@@ -130,7 +134,7 @@ def main():
             if use_keyword_filter and keyword_query:
                 st.info("步骤3/4: 根据关键词过滤论文...")
                 matcher = AbstractMatcher()
-                keyword_indices = matcher.process_csv(csv_filename, keyword_query)
+                keyword_indices = matcher.process_store(store, keyword_query)
                 progress_bar.progress(70)
             else:
                 st.info("步骤3/4: 跳过关键词过滤...")
@@ -152,8 +156,7 @@ def main():
                 final_indices = keyword_indices
             else:
                 # 都不使用，获取所有论文索引
-                df = pd.read_csv(csv_filename)
-                final_indices = list(range(len(df)))
+                final_indices = list(range(store.count()))
             
             if not final_indices:
                 st.error("没有找到符合条件的论文，请调整过滤条件后重试。")
@@ -162,14 +165,30 @@ def main():
             # 第四步：下载论文并生成摘要
             st.info("步骤4/4: 生成论文摘要...")
             assistant = PaperAssistant(output_dir=pdf_folder)
-            markdown_content = assistant.process_and_download(csv_filename, final_indices)
+            
+            # 每篇论文生成完成后立即显示，正在生成的论文实时显示部分摘要
+            markdown_content = assistant.markdown_header()
+            display_markdown_with_images(markdown_content)
+            live = st.empty()
+            done = 0
+            for index, section in assistant.stream_store_sections(
+                    store, final_indices, on_delta=lambda index, text: live.markdown(text)):
+                live.empty()
+                display_markdown_with_images(section)
+                markdown_content += section
+                live = st.empty()
+                done += 1
+                progress_bar.progress(70 + 30 * done // len(final_indices))
+            live.empty()
             
             progress_bar.progress(100)
+            get_default_cache().log_stats()
+            log_stage_stats()
+            get_gateway().log_stats()
+            get_scheduler().log_stats()
             
             # 显示结果
             st.success(f"成功生成论文快报，共包含 {len(final_indices)} 篇论文（从 {papers_count} 篇论文中筛选）")
-            # 使用新的display_markdown_with_images函数显示markdown内容
-            display_markdown_with_images(markdown_content)
             
             # 生成Word文档
             docx_content = markdown_to_docx(markdown_content)
@@ -6,10 +6,17 @@ import os
 import tarfile
 import datetime as dt
 import html_extractor as himage
-import fitz
 import asyncio
+import threading
+import io
+import time
+import tempfile
+import requests
 from tqdm.asyncio import tqdm as async_tqdm
 import logging
+from download_scheduler import DownloadScheduler, host_of
+from pdf_cache import PdfCache
+from pdf_extraction_engine import extract_text, get_engine
 
 QUERY = "(cat:cs.DC OR cat:cs.AR)"
 # QUERY = "cat:cs.AI"
@@ -35,58 +42,196 @@ def load_authors_csv():
     meta_authors = convert_to_lastfirst(meta_authors)
     return [google_authors, meta_authors]
 
-async def download_pdf_async(r, pdf_folder_path):
+async def download_pdf_async(r, pdf_folder_path, scheduler=None):
     """使用 arxiv 内置方法异步下载 PDF 文件，使用论文 ID 作为文件名"""
     # 使用论文 ID 作为文件名
     paper_id = r.get_short_id()
     pdf_path = os.path.join(pdf_folder_path, f"{paper_id}.pdf")
     
     try:
-        # 使用 arxiv 内置的下载方法
-        await asyncio.to_thread(r.download_pdf, dirpath=pdf_folder_path, filename=f"{paper_id}.pdf")
+        if scheduler is not None:
+            # 由调度器控制并发、限速、重试和超时
+            await scheduler.run(download_pdf_file, r.pdf_url, pdf_path, host=host_of(r.pdf_url))
+        else:
+            await asyncio.to_thread(download_pdf_file, r.pdf_url, pdf_path)
         return pdf_path
     except Exception as e:
         logging.error(f"下载 PDF 失败 {paper_id}: {str(e)}")
         return None
 
-async def extract_pdf_content_async(pdf_path):
-    """异步从PDF中提取文本内容"""
-    return await asyncio.to_thread(extract_pdf_content, pdf_path)
+def iter_download(url, timeout=60, chunk_size=64 * 1024):
+    """
+    流式下载，逐块返回内容；timeout是整个下载的总时间上限，
+    超时时抛出TimeoutError并关闭连接，下载线程不会在超时后继续运行
+    """
+    deadline = time.monotonic() + timeout
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"下载超过{timeout}秒: {url}")
+            yield chunk
 
-def extract_pdf_content(pdf_path):
-    """从PDF中提取文本内容 - 只提取第一页"""
+def download_pdf_file(url, pdf_path, timeout=60, chunk_size=64 * 1024):
+    """
+    将PDF下载到临时文件，完成后原子地重命名为pdf_path，
+    失败或超时时删除临时文件，不会留下写了一半的PDF
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(pdf_path) or ".")
     try:
-        with fitz.open(pdf_path) as pdf_doc:
-            if len(pdf_doc) > 0:
-                return pdf_doc[0].get_text("text")
-            else:
-                logging.warning(f"PDF文件 {pdf_path} 没有页面")
-                return ""
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter_download(url, timeout, chunk_size):
+                f.write(chunk)
+        os.replace(tmp_path, pdf_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return pdf_path
+
+def download_pdf_bytes(url, max_bytes=None, timeout=60, chunk_size=64 * 1024):
+    """
+    以流式方式将PDF下载到内存
+    
+    参数:
+        url: PDF地址
+        max_bytes: 读取的最大字节数，达到后提前中止下载；为None时下载完整文件
+        timeout: 整个下载的总超时时间（秒）
+        chunk_size: 每次读取的字节数
+        
+    返回:
+        (PDF字节内容, 是否被截断)
+    """
+    buffer = io.BytesIO()
+    for chunk in iter_download(url, timeout, chunk_size):
+        buffer.write(chunk)
+        if max_bytes is not None and buffer.tell() >= max_bytes:
+            return buffer.getvalue(), True
+    return buffer.getvalue(), False
+
+async def download_pdf_to_memory_async(r, scheduler=None, max_bytes=None):
+    """异步将PDF下载到内存，返回(字节内容, 是否被截断)，失败时返回(None, False)"""
+    paper_id = r.get_short_id()
+    try:
+        if scheduler is not None:
+            return await scheduler.run(download_pdf_bytes, r.pdf_url, max_bytes, host=host_of(r.pdf_url))
+        return await asyncio.to_thread(download_pdf_bytes, r.pdf_url, max_bytes)
     except Exception as e:
-        logging.error(f"PDF内容提取失败 {pdf_path}: {str(e)}")
-        return ""
+        logging.error(f"下载 PDF 到内存失败 {paper_id}: {str(e)}")
+        return None, False
 
-async def download_and_process_pdf(r, pdf_folder_path):
-    """异步下载和处理PDF文件"""
-    pdf_path = await download_pdf_async(r, pdf_folder_path)
-    paper_content = ""
+async def extract_pdf_content_async(pdf_path=None, stream=None):
+    """异步从PDF中提取文本内容，在提取进程池中执行"""
+    return await get_engine().extract_pdf_content_async(pdf_path, stream)
+
+def extract_pdf_content(pdf_path=None, stream=None):
+    """
+    从PDF中提取文本内容 - 只提取第一页
+    
+    参数:
+        pdf_path: PDF文件路径
+        stream: PDF字节内容，提供时直接从内存读取，不访问磁盘
+    """
+    return extract_text(pdf_path, stream, max_pages=1)
+
+async def extract_first_page_async(pdf_path=None, stream=None):
+    """异步提取第一页全文和作者信息块，返回{"Content": ..., "Author_Block": ...}"""
+    return await get_engine().extract_first_page_async(pdf_path, stream)
+
+async def process_pdf_in_memory(r, scheduler=None, max_bytes=None):
+    """
+    将PDF下载到内存并提取第一页内容
+    
+    返回:
+        ({"Content": 第一页文本, "Author_Block": 作者信息块}, 完整的PDF字节内容；下载被截断或失败时为None)
+    """
+    data, truncated = await download_pdf_to_memory_async(r, scheduler, max_bytes)
+    if data is None:
+        return empty_page(), None
+    page = await extract_first_page_async(stream=data)
+    if not page["Content"] and truncated:
+        # 截断的PDF无法解析第一页（例如交叉引用表在文件末尾），重新下载完整文件
+        logging.info(f"截断的PDF无法解析，重新下载完整文件: {r.get_short_id()}")
+        data, truncated = await download_pdf_to_memory_async(r, scheduler)
+        if data is None:
+            return empty_page(), None
+        page = await extract_first_page_async(stream=data)
+    return page, None if truncated else data
+
+def empty_page():
+    return {"Content": "", "Author_Block": ""}
+
+def save_page_to_cache(cache, paper_id, page):
+    """将第一页文本和作者信息块写入缓存"""
+    cache.put_text(paper_id, page["Content"])
+    cache.put_author_block(paper_id, page["Author_Block"])
+
+async def download_and_process_pdf(r, pdf_folder_path, scheduler=None, cache=None, in_memory=False, max_bytes=None):
+    """
+    异步下载和处理PDF文件，提供cache时优先读取缓存
+    
+    参数:
+        in_memory: 是否在内存中下载和解析PDF，不写入pdf_folder_path
+        max_bytes: 内存模式下读取的最大字节数，达到后提前中止下载
+        
+    返回:
+        {"Content": 第一页文本, "Author_Block": 作者信息块}
+    """
+    paper_id = r.get_short_id()
+    pdf_path = None
+    cached_content = None
+    if cache is not None:
+        # 先查第一页文本，再查PDF，都没有才访问网络
+        cached_content = await asyncio.to_thread(cache.get_text, paper_id)
+        if cached_content:
+            author_block = await asyncio.to_thread(cache.get_author_block, paper_id)
+            if author_block is not None:
+                return {"Content": cached_content, "Author_Block": author_block}
+        pdf_path = cache.get_pdf(paper_id)
+        if pdf_path is None and cached_content:
+            # 旧的缓存条目没有作者信息块，分类时会退回使用第一页全文
+            return {"Content": cached_content, "Author_Block": ""}
+    downloaded = pdf_path is None
+    if downloaded and in_memory:
+        page, data = await process_pdf_in_memory(r, scheduler, max_bytes)
+        if cache is not None and page["Content"]:
+            try:
+                if data is not None:
+                    await asyncio.to_thread(cache.put_pdf_bytes, paper_id, data)
+                await asyncio.to_thread(save_page_to_cache, cache, paper_id, page)
+            except OSError as e:
+                logging.warning(f"写入PDF缓存失败 {paper_id}: {str(e)}")
+        return page
+    if downloaded:
+        pdf_path = await download_pdf_async(r, pdf_folder_path, scheduler)
+    page = empty_page()
     
     if pdf_path:
         try:
-            # 异步读取PDF内容
-            paper_content = await extract_pdf_content_async(pdf_path)
+            # 异步读取PDF内容和作者信息块
+            page = await extract_first_page_async(pdf_path)
             
-            # 删除PDF文件
-            await asyncio.to_thread(os.remove, pdf_path)
+            if cache is not None:
+                # 保存到缓存，替代删除
+                if downloaded:
+                    await asyncio.to_thread(cache.put_pdf, paper_id, pdf_path)
+                await asyncio.to_thread(save_page_to_cache, cache, paper_id, page)
+            else:
+                # 删除PDF文件
+                await asyncio.to_thread(os.remove, pdf_path)
             
         except Exception as e:
             logging.error(f"处理PDF失败 {r.title}: {str(e)}")
     
-    return paper_content
+    return page
 
-def get_arxiv_results(query, author_filter=True, start_date=None, end_date=None, max_results=350):
+def query_window_start(start_date):
+    """arXiv查询实际使用的开始时间：查询按天截断，从开始日期当天12:00起算"""
+    return dt.datetime.combine(start_date.date(), dt.time(12, 0))
+
+def build_arxiv_search(query, author_filter=True, start_date=None, end_date=None, max_results=350):
     """
-    构建并执行arxiv搜索查询，返回搜索结果列表
+    构建arxiv搜索查询
     
     参数:
         query: 基础查询字符串
@@ -96,7 +241,7 @@ def get_arxiv_results(query, author_filter=True, start_date=None, end_date=None,
         max_results: 最大结果数量
         
     返回:
-        arxiv搜索结果列表
+        arxiv.Search对象
     """
     if author_filter:
         key_authors = load_authors_csv()
@@ -110,83 +255,212 @@ def get_arxiv_results(query, author_filter=True, start_date=None, end_date=None,
     if start_date == None or end_date == None:
         start_date, end_date = get_last_day()
     else:
-        start_date = start_date.strftime("%Y%m%d") + "1200"
+        start_date = query_window_start(start_date).strftime("%Y%m%d%H%M")
         end_date = end_date.strftime("%Y%m%d") + "1200"
     
     # print(start_date)
     # print(end_date)
     # print(final_query)
     
-    # 使用同步方式获取论文列表
-    client = arxiv.Client()
-    search = arxiv.Search(
+    return arxiv.Search(
         query = f"submittedDate:[{start_date} TO {end_date}] AND {final_query}",
         sort_by = arxiv.SortCriterion.LastUpdatedDate,
         sort_order = arxiv.SortOrder.Descending,
         max_results = max_results
     )
-    return list(client.results(search))
 
-async def fetch_papers_async(pdf_folder_path, csv_filename=FILENAME, query=QUERY, author_filter=True, start_date=None, end_date=None):
+def iter_arxiv_results(query, author_filter=True, start_date=None, end_date=None, max_results=350, page_size=100):
+    """
+    逐条返回arxiv搜索结果，每获取一页就可以开始处理，不必等待全部结果
+    
+    参数:
+        page_size: 每次请求的结果数量
+    """
+    client = arxiv.Client(page_size=page_size)
+    search = build_arxiv_search(query, author_filter, start_date, end_date, max_results)
+    yield from client.results(search)
+
+def get_arxiv_results(query, author_filter=True, start_date=None, end_date=None, max_results=350):
+    """
+    构建并执行arxiv搜索查询，返回搜索结果列表
+    
+    参数:
+        query: 基础查询字符串
+        author_filter: 是否应用作者过滤
+        start_date: 开始日期
+        end_date: 结束日期
+        max_results: 最大结果数量
+        
+    返回:
+        arxiv搜索结果列表
+    """
+    # 使用同步方式获取论文列表
+    return list(iter_arxiv_results(query, author_filter, start_date, end_date, max_results))
+
+async def stream_arxiv_results(query, author_filter=True, start_date=None, end_date=None, max_results=350):
+    """
+    异步逐条返回arxiv搜索结果：在后台线程中分页查询（生产者），
+    通过队列把结果交给事件循环中的下载任务（消费者）
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    # 消费者出错或被取消时通知生产者停止，不再继续分页查询
+    stop = threading.Event()
+    
+    def put(item):
+        if not stop.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+    
+    def produce():
+        try:
+            # 结果按页惰性获取，在两条结果之间检查停止信号即可避免请求下一页
+            for r in iter_arxiv_results(query, author_filter, start_date, end_date, max_results):
+                if stop.is_set():
+                    break
+                put(r)
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+    
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+    await producer
+
+async def fetch_papers_async(pdf_folder_path, csv_filename=FILENAME, query=QUERY, author_filter=True, start_date=None, end_date=None, scheduler=None, cache=None, watermark=None, in_memory=False, max_bytes=None, stream_results=True, store=None):
     """
     异步抓取论文并下载PDF文件
     :param pdf_folder_path: PDF文件保存路径
     :param csv_filename: CSV文件保存路径
+    :param scheduler: 下载调度器，为None时使用默认配置的DownloadScheduler
+    :param cache: PDF缓存，为None时使用默认目录的PdfCache，为False时不使用缓存
+    :param watermark: 抓取水位线，提供时只处理未见过的论文
+    :param in_memory: 是否在内存中下载和解析PDF（不写入磁盘，适用于只读容器）
+    :param max_bytes: 内存模式下每篇论文读取的最大字节数
+    :param stream_results: 是否边分页查询边下载；为False时先获取全部搜索结果再下载
+    :param store: 论文存储（PaperStore），提供时写入存储而不是CSV文件
     :return: 下载的论文数量
     """
-    # 获取arxiv搜索结果
-    results = get_arxiv_results(query, author_filter, start_date, end_date)
-    
     # 确保PDF保存目录存在
-    os.makedirs(pdf_folder_path, exist_ok=True)
+    if not in_memory:
+        os.makedirs(pdf_folder_path, exist_ok=True)
     
     # 写入CSV文件
-    header = ["Paper_ID", "Title", "Authors", "Abstract", "Primary Category", "Categories", "URL", "Date", "Content"]
-    downloaded_count = 0
+    header = ["Paper_ID", "Title", "Authors", "Abstract", "Primary Category", "Categories", "URL", "Date", "Content", "Author_Block"]
     
-    # 异步处理所有论文
+    # 下载调度器，控制对arxiv.org的请求节奏
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = DownloadScheduler()
+    
+    if cache is None:
+        cache = PdfCache()
+    elif cache is False:
+        cache = None
+    
+    results = []
     tasks = []
-    for r in results:
-        tasks.append(download_and_process_pdf(r, pdf_folder_path))
+    total = 0
+    progress = async_tqdm(desc="异步处理论文", unit="篇")
+    
+    async def process(r):
+        page = await download_and_process_pdf(r, pdf_folder_path, scheduler, cache, in_memory, max_bytes)
+        progress.update(1)
+        return page
+    
+    def submit(r):
+        nonlocal total
+        total += 1
+        if watermark is not None and not watermark.is_new(r.get_short_id()):
+            return
+        results.append(r)
+        tasks.append(asyncio.create_task(process(r)))
+        progress.total = len(results)
+        progress.refresh()
     
-    # 使用异步进度条
-    paper_contents = await async_tqdm.gather(*tasks, desc="异步处理论文", unit="篇")
+    # 异步处理所有论文
+    try:
+        if stream_results:
+            # 获取arxiv搜索结果，每到一条就开始下载
+            async for r in stream_arxiv_results(query, author_filter, start_date, end_date):
+                submit(r)
+        else:
+            # 获取arxiv搜索结果
+            for r in await asyncio.to_thread(get_arxiv_results, query, author_filter, start_date, end_date):
+                submit(r)
+        if watermark is not None:
+            logging.info(f"增量抓取: 共{total}篇论文，其中{len(results)}篇为新论文")
+        paper_contents = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        progress.close()
+        scheduler.log_stats()
+        if own_scheduler:
+            scheduler.shutdown()
+        if cache is not None:
+            await asyncio.to_thread(cache.evict)
     
-    # 写入CSV
-    await asyncio.to_thread(write_csv_data, csv_filename, header, results, paper_contents)
+    if store is not None:
+        await asyncio.to_thread(write_store_data, store, results, paper_contents)
+    else:
+        # 写入CSV
+        await asyncio.to_thread(write_csv_data, csv_filename, header, results, paper_contents)
     
-    return len([content for content in paper_contents if content])  # 返回成功下载的数量
+    return len([page for page in paper_contents if page["Content"]])  # 返回成功下载的数量
+
+def build_paper_records(results, paper_contents):
+    """将arxiv搜索结果和第一页内容（含作者信息块）整理为记录列表，字段与CSV表头一致"""
+    records = []
+    for i, r in enumerate(results):
+        authors_strings = []
+        for author in r.authors:
+            authors_strings.append(str(author))
+        
+        # 获取论文ID
+        paper_id = r.get_short_id()
+        
+        records.append({
+            "Paper_ID": paper_id,
+            "Title": r.title,
+            "Authors": authors_strings,
+            "Abstract": r.summary,
+            "Primary Category": r.primary_category,
+            "Categories": r.categories,
+            "URL": r,
+            "Date": r.published,
+            "Content": paper_contents[i]["Content"],
+            "Author_Block": paper_contents[i]["Author_Block"]
+        })
+    return records
 
 def write_csv_data(filename, header, results, paper_contents):
     with open(filename, 'w', newline='', encoding='utf-8') as file:
         writer = csv.DictWriter(file, fieldnames=header)
         writer.writeheader()
-        
-        for i, r in enumerate(results):
-            authors_strings = []
-            for author in r.authors:
-                authors_strings.append(str(author))
-            
-            # 获取论文ID
-            paper_id = r.get_short_id()
-            
-            writer.writerow({
-                "Paper_ID": paper_id,
-                "Title": r.title,
-                "Authors": authors_strings,
-                "Abstract": r.summary,
-                "Primary Category": r.primary_category,
-                "Categories": r.categories,
-                "URL": r,
-                "Date": r.published,
-                "Content": paper_contents[i]
-            })
-
-def fetch_papers(pdf_folder_path, csv_filename=FILENAME, query=QUERY, author_filter=True, start_date=None, end_date=None):
+        writer.writerows(build_paper_records(results, paper_contents))
+
+def write_store_data(store, results, paper_contents):
+    """将本次抓取的论文批量写入论文存储，替换上一次的结果"""
+    store.replace_all(build_paper_records(results, paper_contents))
+
+def fetch_papers(pdf_folder_path, csv_filename=FILENAME, query=QUERY, author_filter=True, start_date=None, end_date=None, scheduler=None, cache=None, watermark=None, in_memory=False, max_bytes=None, stream_results=True, store=None):
     """
     同步接口，调用异步函数
     """
-    result = asyncio.run(fetch_papers_async(pdf_folder_path, csv_filename, query, author_filter, start_date, end_date))
+    result = asyncio.run(fetch_papers_async(pdf_folder_path, csv_filename, query, author_filter, start_date, end_date, scheduler, cache, watermark, in_memory, max_bytes, stream_results, store))
     if result == 0:
         print("没有找到符合条件的论文")
     else:
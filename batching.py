@@ -0,0 +1,28 @@
+def estimate_tokens(text):
+    """粗略估计文本的token数（英文约4个字符一个token）"""
+    return len(text) // 4 + 1
+
+def make_batches(contents, token_budget=24000, max_papers=20):
+    """
+    按token预算把论文分组
+    
+    参数:
+        contents: 键到论文内容的字典
+        token_budget: 每批论文内容的token上限
+        max_papers: 每批最多的论文数
+        
+    返回:
+        字典列表，每个字典是一批论文
+    """
+    batches = []
+    batch, batch_tokens = {}, 0
+    for key, content in contents.items():
+        tokens = estimate_tokens(content)
+        if batch and (batch_tokens + tokens > token_budget or len(batch) >= max_papers):
+            batches.append(batch)
+            batch, batch_tokens = {}, 0
+        batch[key] = content
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
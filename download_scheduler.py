@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from priority_scheduler import get_scheduler
+
+DEFAULT_HOST = "arxiv.org"
+
+
+class TokenBucket:
+    """
+    异步令牌桶，用于限制对单个主机的请求速率
+    """
+    def __init__(self, rate, capacity):
+        """
+        参数:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发请求数）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """获取一个令牌，令牌不足时等待"""
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class DownloadScheduler:
+    """
+    下载调度器：限制并发数、按主机限速、带抖动退避的重试以及单次下载超时，
+    并统计排队深度和吞吐量
+    """
+    def __init__(self, max_concurrency=4, rate_per_host=1.0, burst=2,
+                 max_retries=3, base_delay=1.0, max_delay=30.0, timeout=60.0):
+        """
+        参数:
+            max_concurrency: 最大并发下载数
+            rate_per_host: 每个主机每秒允许的请求数
+            burst: 每个主机允许的突发请求数
+            max_retries: 失败后的最大重试次数
+            base_delay: 退避基础等待时间（秒）
+            max_delay: 退避最大等待时间（秒）
+            timeout: 单次下载的总超时时间（秒），传给下载函数
+        """
+        self.max_concurrency = max_concurrency
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="pdf-download")
+        self.buckets = {}
+        self._semaphore = None
+
+        # 统计信息
+        self.queued = 0
+        self.active = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.started_at = None
+
+    @property
+    def semaphore(self):
+        # 信号量需要在事件循环中创建
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def get_bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate_per_host, self.burst)
+        return self.buckets[host]
+
+    def backoff_delay(self, attempt):
+        """计算第attempt次重试的等待时间（完全抖动）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self, func, *args, host=DEFAULT_HOST, **kwargs):
+        """
+        在调度器控制下执行一次阻塞下载
+
+        参数:
+            func: 阻塞的下载函数，在线程池中执行；需要接受timeout关键字参数，
+                  并在超过这个总时间后自行中止（例如arxiv_pdf.iter_download）
+            host: 请求的目标主机，用于按主机限速
+
+        返回:
+            func的返回值；重试耗尽后抛出最后一次的异常
+        """
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        async with self.semaphore:
+            self.queued -= 1
+            self.active += 1
+            try:
+                result = await self._run_with_retries(func, args, kwargs, host)
+                self.completed += 1
+                return result
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.active -= 1
+
+    async def _run_with_retries(self, func, args, kwargs, host):
+        loop = asyncio.get_running_loop()
+        bucket = self.get_bucket(host)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                # 跨进程的下载槽位，交互请求优先；超时由下载函数自己执行，
+                # 线程结束后才释放槽位，也不会在上一次尝试仍在写文件时开始重试
+                async with get_scheduler().slot_async("download"):
+                    return await loop.run_in_executor(
+                        self.executor, lambda: func(*args, timeout=self.timeout, **kwargs)
+                    )
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                attempt += 1
+                self.retries += 1
+                logging.warning(f"下载失败({host})，{delay:.1f}秒后进行第{attempt}次重试: {e!r}")
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        """返回调度器统计信息"""
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "queued": self.queued,
+            "active": self.active,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "elapsed": elapsed,
+            "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        logging.info(
+            f"下载调度统计: 完成{s['completed']}，失败{s['failed']}，重试{s['retries']}，"
+            f"最大排队{s['max_queue_depth']}，耗时{s['elapsed']:.1f}秒，吞吐量{s['throughput']:.2f}篇/秒"
+        )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def host_of(url):
+    """从URL中提取主机名，无法解析时返回默认主机"""
+    try:
+        return urlparse(url).netloc or DEFAULT_HOST
+    except Exception:
+        return DEFAULT_HOST
@@ -0,0 +1,97 @@
+import os
+import re
+import json
+import logging
+import datetime as dt
+
+DEFAULT_WATERMARK_FILE = "arxiv_watermark.json"
+
+
+def base_paper_id(paper_id):
+    """去掉版本号，例如 2503.16203v2 -> 2503.16203"""
+    return re.sub(r"v\d+$", "", str(paper_id).strip())
+
+
+class FetchWatermark:
+    """
+    持久化的arXiv抓取水位线：记录已处理论文的最新提交时间和论文ID，
+    用于增量抓取时跳过已经处理过的论文
+    """
+    def __init__(self, path=DEFAULT_WATERMARK_FILE, overlap_days=2, max_ids=20000, max_lookback_days=7):
+        """
+        参数:
+            path: 水位线文件路径
+            overlap_days: 查询窗口相对水位线向前回溯的天数，
+                          arXiv的提交时间和可检索时间之间存在延迟，需要重叠窗口避免漏抓
+            max_ids: 最多保留的论文ID数量
+            max_lookback_days: 查询窗口最多回溯的天数，长时间未运行时不会一次抓取过多论文
+        """
+        self.path = path
+        self.overlap_days = overlap_days
+        self.max_ids = max_ids
+        self.max_lookback_days = max_lookback_days
+        self.latest_submitted = None
+        self.seen_ids = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            latest = data.get("latest_submitted")
+            self.latest_submitted = dt.datetime.fromisoformat(latest) if latest else None
+            self.seen_ids = dict(data.get("seen_ids", {}))
+        except (ValueError, OSError) as e:
+            logging.warning(f"读取水位线文件失败，将重新全量抓取: {str(e)}")
+            self.latest_submitted = None
+            self.seen_ids = {}
+
+    def save(self):
+        # 只保留最近提交的论文ID，防止文件无限增长
+        if len(self.seen_ids) > self.max_ids:
+            newest = sorted(self.seen_ids.items(), key=lambda item: item[1], reverse=True)[:self.max_ids]
+            self.seen_ids = dict(newest)
+        data = {
+            "latest_submitted": self.latest_submitted.isoformat() if self.latest_submitted else None,
+            "seen_ids": self.seen_ids,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def start_date(self, default_start, now=None):
+        """
+        计算本次查询的开始时间：有水位线时从最新提交时间向前回溯overlap_days，
+        可以晚于default_start（缩小查询窗口），但不早于max_lookback_days之前
+
+        参数:
+            default_start: 没有水位线时使用的开始时间
+            now: 当前时间，为None时使用dt.datetime.today()
+
+        返回:
+            查询开始时间
+        """
+        if self.latest_submitted is None:
+            return default_start
+        start = self.latest_submitted.replace(tzinfo=None) - dt.timedelta(days=self.overlap_days)
+        earliest = (now or dt.datetime.today()) - dt.timedelta(days=self.max_lookback_days)
+        return max(start, earliest)
+
+    def is_new(self, paper_id):
+        return base_paper_id(paper_id) not in self.seen_ids
+
+    def update(self, paper_id, submitted):
+        """
+        记录一篇已处理的论文
+
+        参数:
+            paper_id: 论文ID（可带版本号）
+            submitted: 提交时间（datetime）
+        """
+        submitted = submitted.astimezone(dt.timezone.utc) if submitted.tzinfo else submitted.replace(tzinfo=dt.timezone.utc)
+        self.seen_ids[base_paper_id(paper_id)] = submitted.isoformat()
+        if self.latest_submitted is None or submitted > self.latest_submitted:
+            self.latest_submitted = submitted
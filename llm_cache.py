@@ -0,0 +1,194 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+DEFAULT_CACHE_PATH = "llm_cache.db"
+
+
+class LLMCache:
+    """
+    磁盘上的大模型响应缓存：按模型、消息哈希和参数索引，
+    支持过期时间（TTL）和按最近访问时间的LRU淘汰，并统计命中率
+    """
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, ttl_seconds=7 * 24 * 3600, max_entries=50000):
+        """
+        参数:
+            db_path: SQLite数据库文件路径
+            ttl_seconds: 缓存条目的有效期（秒）
+            max_entries: 最多保留的条目数
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, content TEXT, "
+                "created_at REAL, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(model, messages, params):
+        """根据模型、消息和其他参数生成缓存键"""
+        payload = json.dumps({"model": model, "messages": messages, "params": params},
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """返回缓存的响应内容，不存在或已过期时返回None"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] <= self.ttl_seconds:
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                with self.lock:
+                    self.hits += 1
+                return row[0]
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, model, content):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now)
+            )
+        with self.lock:
+            self.writes += 1
+            should_evict = self.writes % 100 == 0
+        if should_evict:
+            self.evict()
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self):
+        """删除过期条目，并在超过上限时删除最久未访问的条目"""
+        now = time.time()
+        with self._connect() as conn:
+            expired = conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+            count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            overflow = max(0, count - self.max_entries)
+            if overflow:
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_access LIMIT ?)", (overflow,)
+                )
+        if expired or overflow:
+            logging.info(f"大模型缓存淘汰了{expired + overflow}个条目")
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def log_stats(self):
+        s = self.stats()
+        logging.info(f"大模型缓存统计: 命中{s['hits']}，未命中{s['misses']}，命中率{s['hit_rate']:.1%}")
+
+
+def is_cacheable(params):
+    """只缓存确定性（temperature为0）且非流式的请求"""
+    return params.get("temperature") == 0 and not params.get("stream")
+
+
+def cached_response(content):
+    """构造与OpenAI响应结构一致的缓存响应对象"""
+    message = SimpleNamespace(content=content, role="assistant")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, index=0, finish_reason="stop")],
+                           cached=True)
+
+
+class _CachedCompletions:
+    def __init__(self, completions, cache):
+        self._completions = completions
+        self._cache = cache
+
+    def _key(self, kwargs):
+        params = {k: v for k, v in kwargs.items() if k not in ("model", "messages")}
+        return self._cache.make_key(kwargs.get("model"), kwargs.get("messages"), params)
+
+    def create(self, **kwargs):
+        if not is_cacheable(kwargs):
+            return self._completions.create(**kwargs)
+        key = self._key(kwargs)
+        content = self._cache.get(key)
+        if content is not None:
+            return cached_response(content)
+        response = self._completions.create(**kwargs)
+        content = response.choices[0].message.content
+        if content is not None:
+            self._cache.set(key, kwargs.get("model"), content)
+        return response
+
+    def invalidate(self, **kwargs):
+        """删除与create参数相同的请求的缓存响应（例如回答未通过校验时）"""
+        if is_cacheable(kwargs):
+            self._cache.delete(self._key(kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+class _CachedChat:
+    def __init__(self, chat, cache):
+        self._chat = chat
+        self.completions = _CachedCompletions(chat.completions, cache)
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+
+class CachedChatClient:
+    """
+    包装OpenAI客户端，使chat.completions.create先查缓存；
+    其他属性和方法直接转发给原客户端
+    """
+    def __init__(self, client, cache=None):
+        self._client = client
+        self.cache = cache if cache is not None else get_default_cache()
+        self.chat = _CachedChat(client.chat, self.cache)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """返回进程内共享的默认缓存"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache()
+        return _default_cache
@@ -0,0 +1,348 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import weakref
+import threading
+import httpx
+import openai
+from openai import OpenAI, DefaultHttpxClient
+from adaptive_limiter import parse_reset_seconds
+from tokenization import count_tokens
+from priority_scheduler import get_scheduler
+
+# 可以重试的错误：限流、超时、连接失败和服务端错误
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError)
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class RateBucket:
+    """线程安全的每分钟配额令牌桶（用于请求数和token数）"""
+    def __init__(self, per_minute):
+        """
+        参数:
+            per_minute: 每分钟的配额，同时也是桶的容量
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """取出amount个令牌，不足时等待；超过容量的请求按容量计算，避免永远等待"""
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """按实际用量修正：amount为正时多扣，为负时退还"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class SharedRateBucket:
+    """
+    所有进程共享的每分钟配额桶，状态保存在优先级调度器的协调文件中，
+    界面和后台流水线合起来不会超过账号限额；后台请求不能用掉保留给交互请求的部分。
+    协调文件不可用时退回进程内的令牌桶
+    """
+    def __init__(self, name, per_minute, scheduler=None, max_wait=1.0):
+        """
+        参数:
+            name: 配额名称
+            per_minute: 每分钟的配额
+            scheduler: 优先级调度器，为None时使用get_scheduler()
+            max_wait: 单次等待的上限（秒），等待后重新检查，其他进程可能已退还配额
+        """
+        self.name = name
+        self.per_minute = per_minute
+        self.scheduler = scheduler
+        self.max_wait = max_wait
+        self.fallback = RateBucket(per_minute)
+
+    def _scheduler(self):
+        return self.scheduler or get_scheduler()
+
+    def acquire(self, amount=1):
+        """取出amount个令牌，不足时等待"""
+        scheduler = self._scheduler()
+        if not scheduler.shared:
+            self.fallback.acquire(amount)
+            return
+        while True:
+            try:
+                wait = scheduler.take_quota(self.name, amount, self.per_minute)
+            except sqlite3.Error as e:
+                logging.warning(f"共享配额不可用，使用进程内限速: {str(e)}")
+                self.fallback.acquire(amount)
+                return
+            if wait <= 0:
+                return
+            time.sleep(min(wait, self.max_wait))
+
+    def adjust(self, amount):
+        """按实际用量修正：amount为正时多扣，为负时退还"""
+        scheduler = self._scheduler()
+        if not scheduler.shared:
+            self.fallback.adjust(amount)
+            return
+        try:
+            scheduler.adjust_quota(self.name, amount, self.per_minute)
+        except sqlite3.Error as e:
+            logging.warning(f"共享配额修正失败: {str(e)}")
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，一段时间内直接拒绝请求；
+    冷却结束后放行一个试探请求，成功则关闭，失败则重新打开
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        参数:
+            failure_threshold: 打开熔断器的连续失败次数
+            reset_timeout: 打开后的冷却时间（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                raise CircuitOpenError("大模型接口连续失败，熔断器已打开，暂时拒绝请求")
+            # 半开状态：只放行一个试探请求
+            self.trial_in_flight = True
+
+    def on_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info("试探请求成功，熔断器关闭")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    logging.warning(f"大模型接口连续失败{self.failures}次，熔断器打开{self.reset_timeout:.0f}秒")
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+
+def retry_after_seconds(error):
+    """从错误响应的Retry-After（或retry-after-ms）响应头中读取等待时间"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    milliseconds = response.headers.get("retry-after-ms")
+    if milliseconds:
+        try:
+            return float(milliseconds) / 1000
+        except ValueError:
+            pass
+    return parse_reset_seconds(response.headers.get("retry-after"))
+
+
+def estimate_request_tokens(kwargs):
+    """估计一次请求占用的token数：消息内容加上最大输出长度"""
+    model = kwargs.get("model") or "gpt-4o"
+    prompt = "".join(str(message.get("content") or "") for message in kwargs.get("messages", []))
+    completion = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 1000
+    return count_tokens(prompt, model) + completion
+
+
+class _GatewayCompletions:
+    def __init__(self, gateway):
+        self._gateway = gateway
+
+    def create(self, **kwargs):
+        return self._gateway.create_chat_completion(**kwargs)
+
+
+class _GatewayChat:
+    def __init__(self, gateway):
+        self.completions = _GatewayCompletions(gateway)
+
+
+class LLMGateway:
+    """
+    进程内共享的大模型网关：持有一个带连接池的OpenAI客户端，
+    用跨进程共享的每分钟请求数和token数配额限速，按Retry-After退避重试，连续失败时熔断；
+    接口与OpenAI客户端的chat.completions.create一致，可以直接包在CachedChatClient里
+    """
+    def __init__(self, api_key=None, rpm=500, tpm=300000, max_retries=5, base_delay=1.0, max_delay=60.0,
+                 failure_threshold=5, reset_timeout=30.0, max_connections=32):
+        """
+        参数:
+            api_key: OpenAI API密钥，为None时读取OPENAI_API_KEY环境变量
+            rpm: 每分钟请求数上限（所有进程合计）
+            tpm: 每分钟token数上限（所有进程合计）
+            max_retries: 可重试错误的最大重试次数
+            base_delay: 指数退避的初始等待时间（秒）
+            max_delay: 单次等待时间上限（秒）
+            failure_threshold: 熔断器打开的连续失败次数
+            reset_timeout: 熔断器打开后的冷却时间（秒）
+            max_connections: 连接池的最大连接数
+        """
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("请提供OpenAI API密钥或设置OPENAI_API_KEY环境变量")
+        self.response_hooks = []
+        self.hooks_lock = threading.Lock()
+        # 重试由网关负责，关闭SDK内置的重试
+        self.client = OpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=DefaultHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                event_hooks={"response": [self._on_response]}
+            )
+        )
+        # 配额桶在所有进程间共享，界面和后台流水线共用同一个账号限额
+        self.request_bucket = SharedRateBucket("llm_requests", rpm)
+        self.token_bucket = SharedRateBucket("llm_tokens", tpm)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.chat = _GatewayChat(self)
+
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def add_response_hook(self, hook):
+        """
+        注册httpx响应钩子（例如自适应并发限制器），绑定方法以弱引用保存，
+        对象被回收后自动移除
+        """
+        ref = weakref.WeakMethod(hook) if hasattr(hook, "__self__") else (lambda: hook)
+        with self.hooks_lock:
+            self.response_hooks.append(ref)
+
+    def _on_response(self, response):
+        with self.hooks_lock:
+            self.response_hooks = [ref for ref in self.response_hooks if ref() is not None]
+            hooks = [ref() for ref in self.response_hooks]
+        for hook in hooks:
+            if hook is not None:
+                hook(response)
+
+    def _backoff(self, attempt, error):
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        return min(delay, self.max_delay)
+
+    def create_chat_completion(self, **kwargs):
+        """
+        经过限速、重试和熔断调用chat.completions.create
+
+        返回:
+            OpenAI响应对象（流式请求时为流对象）
+        """
+        estimated = estimate_request_tokens(kwargs)
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                with self.stats_lock:
+                    self.rejected += 1
+                raise
+            with self.stats_lock:
+                self.requests += 1
+            try:
+                # 先在跨进程的优先级队列中排队，交互请求会越过后台流水线的请求；
+                # 流式请求只在建立连接期间占用槽位
+                with get_scheduler().slot("llm"):
+                    self.request_bucket.acquire()
+                    self.token_bucket.acquire(estimated)
+                    response = self.client.chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                # 限流不代表接口故障，不计入熔断
+                if isinstance(e, openai.RateLimitError):
+                    self.breaker.on_success()
+                else:
+                    self.breaker.on_failure()
+                if attempt == self.max_retries:
+                    with self.stats_lock:
+                        self.failures += 1
+                    raise
+                delay = self._backoff(attempt, e)
+                with self.stats_lock:
+                    self.retries += 1
+                logging.warning(f"大模型请求失败（第{attempt + 1}次），{delay:.1f}秒后重试: {str(e)}")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # 参数错误等不可重试的错误，说明接口本身是通的
+                self.breaker.on_success()
+                with self.stats_lock:
+                    self.failures += 1
+                raise
+            self.breaker.on_success()
+            usage = getattr(response, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                self.token_bucket.adjust(usage.total_tokens - estimated)
+            return response
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rejected": self.rejected,
+            }
+
+    def log_stats(self):
+        s = self.stats()
+        logging.info(f"大模型网关统计: 请求{s['requests']}次，重试{s['retries']}次，"
+                     f"失败{s['failures']}次，熔断拒绝{s['rejected']}次")
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    返回进程内共享的大模型网关，
+    可以用OPENAI_RPM和OPENAI_TPM环境变量设置账号的限额
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway(
+                rpm=int(os.environ.get("OPENAI_RPM", 500)),
+                tpm=int(os.environ.get("OPENAI_TPM", 300000)),
+            )
+        return _gateway
@@ -0,0 +1,127 @@
+import time
+import logging
+import threading
+
+# 各阶段使用的模型：model为最终使用的大模型，fast_model为级联模式下先尝试的小模型
+STAGE_MODELS = {
+    "classification": {"model": "gpt-4o", "fast_model": "gpt-4o-mini"},
+    "affiliation_analysis": {"model": "gpt-4o", "fast_model": "gpt-4o-mini"},
+    "abstract_matching": {"model": "gpt-4o", "fast_model": "gpt-4o-mini"},
+    "summary": {"model": "gpt-4o", "fast_model": "gpt-4o-mini"},
+}
+
+# 默认开启级联的阶段（判断简单、输出容易校验的阶段）
+CASCADE_STAGES = {"classification", "abstract_matching"}
+
+# 小模型输出不合法时抛出的异常，会触发升级；网络和限流等其他异常直接抛出
+VALIDATION_ERRORS = (ValueError, TypeError, KeyError, IndexError, AttributeError)
+
+
+class LowConfidence(ValueError):
+    """小模型的输出通过了格式校验，但置信度不足"""
+
+
+class StageStats:
+    """单个阶段的调用统计：调用次数、升级次数和各模型的延迟"""
+    def __init__(self, stage):
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.escalations = 0
+        self.latency = {}
+
+    def record(self, model, seconds):
+        with self.lock:
+            total, count = self.latency.get(model, (0.0, 0))
+            self.latency[model] = (total + seconds, count + 1)
+
+    def record_call(self, escalated):
+        with self.lock:
+            self.calls += 1
+            if escalated:
+                self.escalations += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.calls if self.calls else 0.0,
+                "avg_latency": {model: total / count for model, (total, count) in self.latency.items()},
+            }
+
+
+_stage_stats = {}
+_stage_stats_lock = threading.Lock()
+
+
+def get_stage_stats(stage):
+    with _stage_stats_lock:
+        if stage not in _stage_stats:
+            _stage_stats[stage] = StageStats(stage)
+        return _stage_stats[stage]
+
+
+def log_stage_stats():
+    """输出所有阶段的升级率和平均延迟"""
+    with _stage_stats_lock:
+        stats = list(_stage_stats.values())
+    for stage_stats in stats:
+        s = stage_stats.snapshot()
+        latency = "，".join(f"{model}平均{seconds:.2f}秒" for model, seconds in s["avg_latency"].items())
+        logging.info(f"阶段{stage_stats.stage}: 调用{s['calls']}次，升级{s['escalations']}次"
+                     f"（{s['escalation_rate']:.1%}），{latency}")
+
+
+class ModelRouter:
+    """
+    按阶段选择模型；级联模式下先用小模型回答，
+    输出校验失败或置信度不足时再用大模型重新请求
+    """
+    def __init__(self, stage, model=None, fast_model=None, cascade=None):
+        """
+        参数:
+            stage: 阶段名称，对应STAGE_MODELS中的键
+            model: 大模型名称，为None时使用STAGE_MODELS中的配置
+            fast_model: 小模型名称，为None时使用STAGE_MODELS中的配置
+            cascade: 是否开启级联，为None时按CASCADE_STAGES决定
+        """
+        config = STAGE_MODELS.get(stage, {})
+        self.stage = stage
+        self.model = model or config.get("model", "gpt-4o")
+        self.fast_model = fast_model or config.get("fast_model")
+        self.cascade = stage in CASCADE_STAGES if cascade is None else cascade
+        self.stats = get_stage_stats(stage)
+
+    def models(self):
+        """按尝试顺序返回本阶段使用的模型"""
+        if self.cascade and self.fast_model and self.fast_model != self.model:
+            return [self.fast_model, self.model]
+        return [self.model]
+
+    def run(self, request):
+        """
+        按级联顺序调用request，直到某个模型的输出通过校验
+
+        参数:
+            request: 以模型名称为参数的函数，输出不合法时抛出ValueError等校验异常，
+                     置信度不足时抛出LowConfidence
+
+        返回:
+            request的返回值；最后一个模型的异常直接抛出
+        """
+        models = self.models()
+        for attempt, model in enumerate(models):
+            start = time.monotonic()
+            try:
+                result = request(model)
+            except VALIDATION_ERRORS as e:
+                self.stats.record(model, time.monotonic() - start)
+                if attempt == len(models) - 1:
+                    self.stats.record_call(escalated=attempt > 0)
+                    raise
+                logging.info(f"阶段{self.stage}: {model}的输出未通过校验，升级到{models[attempt + 1]}: {str(e)}")
+                continue
+            self.stats.record(model, time.monotonic() - start)
+            self.stats.record_call(escalated=attempt > 0)
+            return result
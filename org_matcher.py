@@ -0,0 +1,203 @@
+import unicodedata
+from collections import deque
+from orgs import orgs, org_aliases
+
+# 必须按原样大小写匹配的名称（缩写或容易与普通单词混淆的名称）
+CASE_SENSITIVE = {
+    "MIT", "CMU", "UIUC", "UBC", "AWS", "AI2", "IBM", "NYU", "UMD", "MSR",
+    "FAIR", "BAIR", "UQAM", "Mila", "Amii", "Meta", "xAI", "Xai", "Apple", "Intel",
+}
+
+# 命中后仍不能确定是否为目标机构的名称，需要交给大模型判断
+AMBIGUOUS_NAMES = {
+    "University of Maryland",  # 可能是其他校区
+    "UMD",
+    "Waterloo",
+    "Washington University",   # 容易与University of Washington混淆
+}
+
+
+def fold_accents(text):
+    """去掉重音符号（例如 Québec -> Quebec），保留大小写"""
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def lower_same_length(text):
+    """逐字符转小写，遇到会改变长度的字符时保持原样，保证位置一一对应"""
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def alias_groups(aliases):
+    """把别名表中的边合并成等价组，返回 名称 -> 组内所有名称 的字典"""
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for alias, canonical in aliases.items():
+        parent[find(alias)] = find(canonical)
+
+    groups = {}
+    for name in parent:
+        groups.setdefault(find(name), set()).add(name)
+    return {name: groups[find(name)] for name in parent}
+
+
+class AhoCorasick:
+    """多模式字符串匹配自动机，一次扫描找出所有模式的出现位置"""
+    def __init__(self, patterns):
+        """
+        参数:
+            patterns: 模式字符串列表
+        """
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(index)
+
+        # 广度优先构建失败指针
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def search(self, text):
+        """
+        返回:
+            (起始位置, 结束位置, 模式索引) 的列表
+        """
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for index in self.output[state]:
+                end = position + 1
+                matches.append((end - len(self.patterns[index]), end, index))
+        return matches
+
+
+class OrgMatcher:
+    """
+    本地机构名称匹配器：把目标机构及其别名编译成多模式自动机，
+    按词边界和大小写规则判断机构字符串是否包含目标机构
+    """
+    MATCH = "match"
+    NO_MATCH = "no_match"
+    AMBIGUOUS = "ambiguous"
+
+    def __init__(self, target_orgs=None, aliases=None):
+        """
+        参数:
+            target_orgs: 目标机构列表，为None时使用orgs
+            aliases: 别名表，为None时使用orgs.org_aliases
+        """
+        target_orgs = orgs if target_orgs is None else target_orgs
+        groups = alias_groups(org_aliases if aliases is None else aliases)
+
+        names = set()
+        for org in target_orgs:
+            names.update(groups.get(org, {org}))
+
+        self.names = sorted(names)
+        self.folded_names = [fold_accents(name) for name in self.names]
+        self.automaton = AhoCorasick([lower_same_length(name) for name in self.folded_names])
+
+    @staticmethod
+    def _is_boundary(text, position):
+        return position < 0 or position >= len(text) or not text[position].isalnum()
+
+    def classify(self, text):
+        """
+        判断一条机构字符串是否包含目标机构
+
+        返回:
+            MATCH、NO_MATCH 或 AMBIGUOUS
+        """
+        if not isinstance(text, str) or not text or text == "Error" or text.startswith("Error:"):
+            return self.NO_MATCH
+
+        folded = fold_accents(text)
+        ambiguous = False
+        for start, end, index in self.automaton.search(lower_same_length(folded)):
+            if not (self._is_boundary(folded, start - 1) and self._is_boundary(folded, end)):
+                continue
+            name = self.names[index]
+            if name in CASE_SENSITIVE and folded[start:end] != self.folded_names[index]:
+                # 大小写不一致，例如 "meta-learning" 或 "XAI"（可解释AI）
+                ambiguous = True
+                continue
+            if name in AMBIGUOUS_NAMES:
+                ambiguous = True
+                continue
+            return self.MATCH
+
+        # 非ASCII字符可能是机构名称的其他语言写法，本地无法判断
+        if ambiguous or any(ord(c) > 127 for c in folded):
+            return self.AMBIGUOUS
+        return self.NO_MATCH
+
+    def loose_matches(self, text):
+        """
+        宽松匹配：忽略大小写规则和歧义名单，返回在词边界上出现的所有名称
+
+        返回:
+            [(原文中的片段, 目标机构名称), ...]
+        """
+        if not isinstance(text, str) or not text:
+            return []
+        folded = fold_accents(text)
+        matches = []
+        for start, end, index in self.automaton.search(lower_same_length(folded)):
+            if self._is_boundary(folded, start - 1) and self._is_boundary(folded, end):
+                matches.append((folded[start:end], self.names[index]))
+        return matches
+
+    def loose_match(self, text):
+        """
+        宽松匹配是否命中，作为复核大模型结果的廉价信号
+        """
+        return bool(self.loose_matches(text))
+
+    def match_rows(self, affiliations):
+        """
+        批量匹配机构列
+
+        参数:
+            affiliations: 机构列（按论文顺序）
+
+        返回:
+            (匹配的索引列表, 需要大模型判断的索引列表)
+        """
+        matched, ambiguous = [], []
+        for i, affiliation in enumerate(affiliations):
+            result = self.classify(affiliation)
+            if result == self.MATCH:
+                matched.append(i)
+            elif result == self.AMBIGUOUS:
+                ambiguous.append(i)
+        return matched, ambiguous
@@ -59,4 +59,182 @@ orgs = [
     "Google",
     "DeepMind",
     "Oxford"
-]
\ No newline at end of file
+]
+
+# 机构别名表：别名 -> orgs中的标准名称，互为别名的机构属于同一组
+org_aliases = {
+    "AI2": "Allen Institute for AI",
+    "Massachusetts Institute of Technology": "MIT",
+    "Carnegie Mellon": "CMU",
+    "University of Illinois Urbana-Champaign": "UIUC",
+    "University of Texas at Austin": "UT Austin",
+    "Quebec Artificial Intelligence Institute": "Mila",
+    "University of British Columbia": "UBC",
+    "AWS": "Amazon",
+    "Allen Institute for Artificial Intelligence": "Allen Institute for AI",
+    "Stanford University": "Stanford",
+    "University of California, Berkeley": "UC Berkeley",
+    "University of California Berkeley": "UC Berkeley",
+    "Berkeley AI Research": "UC Berkeley",
+    "BAIR": "UC Berkeley",
+    "Massachusetts Inst. of Technology": "Massachusetts Institute of Technology",
+    "Carnegie Mellon University": "Carnegie Mellon",
+    "Princeton": "Princeton University",
+    "University of Illinois at Urbana-Champaign": "University of Illinois Urbana-Champaign",
+    "University of Illinois Urbana Champaign": "University of Illinois Urbana-Champaign",
+    "Georgia Tech": "Georgia Institute of Technology",
+    "NYU": "New York University",
+    "Caltech": "California Institute of Technology",
+    "UT-Austin": "UT Austin",
+    "University of Maryland": "University of Maryland, College Park",
+    "UMD": "University of Maryland, College Park",
+    "UMich": "University of Michigan",
+    "Cornell": "Cornell University",
+    "Cornell Tech": "Cornell University",
+    "Harvard": "Harvard University",
+    "UofT": "University of Toronto",
+    "Waterloo": "University of Waterloo",
+    "UQAM": "Université du Québec à Montréal",
+    "McGill": "McGill University",
+    "Quebec AI Institute": "Quebec Artificial Intelligence Institute",
+    "Alberta Machine Intelligence Institute": "Amii",
+    "xAI": "Xai",
+    "MosaicML": "Databricks",
+    "Amazon Web Services": "AWS",
+    "Facebook": "Meta",
+    "FAIR": "Meta",
+    "Microsoft Research": "Microsoft",
+    "MSR": "Microsoft",
+    "International Business Machines": "IBM",
+    "Nvidia": "NVIDIA",
+    "Alibaba Group": "Alibaba",
+    "DAMO Academy": "Alibaba",
+    "Qwen": "Alibaba",
+    "DeepSeek-AI": "DeepSeek",
+    "Bytedance": "ByteDance",
+    "Alphabet": "Google",
+    "Google DeepMind": "DeepMind",
+    "University of Oxford": "Oxford",
+}
+
+# 邮箱域名 -> 机构名称，用于根据作者邮箱直接确定机构（子域名按后缀匹配，例如 cs.stanford.edu）
+org_domains = {
+    "allenai.org": "Allen Institute for AI",
+    "stanford.edu": "Stanford University",
+    "berkeley.edu": "UC Berkeley",
+    "ucla.edu": "University of California, Los Angeles",
+    "ucsd.edu": "University of California, San Diego",
+    "uci.edu": "University of California, Irvine",
+    "ucsb.edu": "University of California, Santa Barbara",
+    "ucsc.edu": "University of California, Santa Cruz",
+    "ucdavis.edu": "University of California, Davis",
+    "mit.edu": "MIT",
+    "cmu.edu": "Carnegie Mellon University",
+    "princeton.edu": "Princeton University",
+    "uw.edu": "University of Washington",
+    "washington.edu": "University of Washington",
+    "wustl.edu": "Washington University in St. Louis",
+    "illinois.edu": "UIUC",
+    "gatech.edu": "Georgia Institute of Technology",
+    "nyu.edu": "New York University",
+    "caltech.edu": "California Institute of Technology",
+    "utexas.edu": "UT Austin",
+    "umd.edu": "University of Maryland, College Park",
+    "umich.edu": "University of Michigan",
+    "cornell.edu": "Cornell University",
+    "columbia.edu": "Columbia University",
+    "harvard.edu": "Harvard University",
+    "yale.edu": "Yale University",
+    "uchicago.edu": "University of Chicago",
+    "upenn.edu": "University of Pennsylvania",
+    "jhu.edu": "Johns Hopkins University",
+    "purdue.edu": "Purdue University",
+    "wisc.edu": "University of Wisconsin-Madison",
+    "usc.edu": "University of Southern California",
+    "utoronto.ca": "University of Toronto",
+    "toronto.edu": "University of Toronto",
+    "uwaterloo.ca": "University of Waterloo",
+    "uqam.ca": "Université du Québec à Montréal",
+    "mcgill.ca": "McGill University",
+    "mila.quebec": "Mila",
+    "umontreal.ca": "Université de Montréal",
+    "vectorinstitute.ai": "Vector Institute",
+    "amii.ca": "Amii",
+    "ualberta.ca": "University of Alberta",
+    "ubc.ca": "University of British Columbia",
+    "ox.ac.uk": "University of Oxford",
+    "cam.ac.uk": "University of Cambridge",
+    "ucl.ac.uk": "University College London",
+    "imperial.ac.uk": "Imperial College London",
+    "ed.ac.uk": "University of Edinburgh",
+    "ethz.ch": "ETH Zurich",
+    "epfl.ch": "EPFL",
+    "mpg.de": "Max Planck Society",
+    "tum.de": "Technical University of Munich",
+    "inria.fr": "Inria",
+    "tsinghua.edu.cn": "Tsinghua University",
+    "pku.edu.cn": "Peking University",
+    "sjtu.edu.cn": "Shanghai Jiao Tong University",
+    "zju.edu.cn": "Zhejiang University",
+    "fudan.edu.cn": "Fudan University",
+    "ustc.edu.cn": "University of Science and Technology of China",
+    "ia.ac.cn": "Chinese Academy of Sciences",
+    "ict.ac.cn": "Chinese Academy of Sciences",
+    "cas.cn": "Chinese Academy of Sciences",
+    "ucas.ac.cn": "University of Chinese Academy of Sciences",
+    "nju.edu.cn": "Nanjing University",
+    "hku.hk": "The University of Hong Kong",
+    "cuhk.edu.hk": "The Chinese University of Hong Kong",
+    "ust.hk": "HKUST",
+    "nus.edu.sg": "National University of Singapore",
+    "ntu.edu.sg": "Nanyang Technological University",
+    "kaist.ac.kr": "KAIST",
+    "snu.ac.kr": "Seoul National University",
+    "u-tokyo.ac.jp": "The University of Tokyo",
+    "technion.ac.il": "Technion",
+    "weizmann.ac.il": "Weizmann Institute of Science",
+    "apple.com": "Apple",
+    "nvidia.com": "NVIDIA",
+    "x.ai": "xAI",
+    "cohere.com": "Cohere",
+    "cohere.ai": "Cohere",
+    "databricks.com": "Databricks",
+    "mosaicml.com": "Databricks",
+    "scale.com": "Scale AI",
+    "together.ai": "Together AI",
+    "together.xyz": "Together AI",
+    "figure.ai": "Figure AI",
+    "intel.com": "Intel",
+    "ibm.com": "IBM",
+    "amazon.com": "Amazon",
+    "amazon.de": "Amazon",
+    "amazon.co.uk": "Amazon",
+    "tesla.com": "Tesla",
+    "adobe.com": "Adobe",
+    "meta.com": "Meta",
+    "fb.com": "Meta",
+    "mistral.ai": "Mistral",
+    "microsoft.com": "Microsoft",
+    "anthropic.com": "Anthropic",
+    "alibaba-inc.com": "Alibaba",
+    "deepseek.com": "DeepSeek",
+    "bytedance.com": "ByteDance",
+    "openai.com": "OpenAI",
+    "google.com": "Google",
+    "deepmind.com": "Google DeepMind",
+    "huawei.com": "Huawei",
+    "tencent.com": "Tencent",
+    "baidu.com": "Baidu",
+    "samsung.com": "Samsung",
+    "qualcomm.com": "Qualcomm",
+    "salesforce.com": "Salesforce",
+    "sony.com": "Sony",
+    "amd.com": "AMD",
+}
+
+# 公共邮箱域名，无法据此判断机构
+webmail_domains = {
+    "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "live.com", "yahoo.com",
+    "icloud.com", "me.com", "protonmail.com", "proton.me", "qq.com", "163.com", "126.com",
+    "foxmail.com", "sina.com", "aliyun.com", "mail.com",
+}
@@ -1,27 +1,107 @@
 import pandas as pd
 import os
+import json
 import logging
-from openai import OpenAI
+import concurrent.futures
+from openai import RateLimitError
+from llm_cache import CachedChatClient
+from llm_gateway import get_gateway
+from batching import make_batches
 from tqdm import tqdm
+from adaptive_limiter import AdaptiveConcurrencyLimiter, parse_reset_seconds
+from affiliation_resolver import AffiliationResolver, count_authors
+from model_router import ModelRouter, LowConfidence, VALIDATION_ERRORS
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+CLASSIFICATION_PROMPT = """
+        Based on the following paper content, determine the author affiliation(s) strictly from the listed author information, such as university, company, or research institution. Do not infer affiliations based on the models, tools, or datasets used in the paper (e.g., mentioning OpenAI or GPT does not mean OpenAI is an author affiliation).
+        Please respond with only the organization name(s) from the author list, without any additional text. If author affiliations are not listed or are ambiguous, respond with "Unknown".
+        Format your response as follows:
+        ["Organization1", "Organization2", "Organization3", ...]
+        """
+
+BATCH_CLASSIFICATION_PROMPT = """
+        You will receive the first pages of several papers. Each paper starts with a line "### Paper <id>".
+        For each paper, determine the author affiliation(s) strictly from the listed author information, such as university, company, or research institution. Do not infer affiliations based on the models, tools, or datasets used in the paper (e.g., mentioning OpenAI or GPT does not mean OpenAI is an author affiliation).
+        Respond with a JSON object that maps every paper id to a list of organization names, for example:
+        {"P1": ["Organization1", "Organization2"], "P2": ["Unknown"]}
+        Use ["Unknown"] if author affiliations are not listed or are ambiguous. Include every paper id exactly once and nothing else.
+        """
+
+# 作者信息块短于该长度时认为提取失败，退回使用第一页全文
+MIN_AUTHOR_BLOCK_CHARS = 40
+
+def classification_input(author_block, content):
+    """选择分类时发送给模型的文本：优先使用作者信息块，提取失败时使用第一页全文"""
+    if isinstance(author_block, str) and len(author_block.strip()) >= MIN_AUTHOR_BLOCK_CHARS:
+        return author_block
+    return content
+
+def format_affiliations(organizations):
+    """将机构列表转换为与单篇分类一致的输出格式"""
+    organizations = [str(org).strip() for org in organizations if str(org).strip()]
+    if not organizations or organizations == ["Unknown"]:
+        return "Unknown"
+    return json.dumps(organizations, ensure_ascii=False)
+
 class PaperAffiliationClassifier:
-    def __init__(self, model="gpt-4o"):
+    def __init__(self, model="gpt-4o", concurrency=4, max_concurrency=16, use_resolver=True,
+                 fast_model=None, cascade=None):
         """
         初始化论文机构分类器
         
         参数:
-            api_key: OpenAI API密钥，如果为None则从环境变量获取
             model: 使用的OpenAI模型名称
+            concurrency: 并发分类的初始并发数
+            max_concurrency: 并发分类的最大并发数
+            use_resolver: 是否先根据作者邮箱在本地解析机构，只把无法解析的论文交给模型
+            fast_model: 级联模式下先尝试的小模型，为None时使用model_router.STAGE_MODELS中的配置
+            cascade: 是否开启级联（小模型输出不合法或回答Unknown时再用model），为None时使用默认配置
         """
         self.api_key = os.environ.get("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("请提供OpenAI API密钥或设置OPENAI_API_KEY环境变量")
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.model = model
+        # 并发数根据429响应和限流响应头自适应调整
+        self.limiter = AdaptiveConcurrencyLimiter(initial=concurrency, max_limit=max_concurrency)
+        # 所有阶段共用的网关负责全局限速、重试和熔断，这里只按响应调整本阶段的并发
+        gateway = get_gateway()
+        gateway.add_response_hook(self._observe_response)
+        self.client = CachedChatClient(gateway)
+        self.router = ModelRouter("classification", model, fast_model, cascade)
+        self.model = self.router.model
+        self.resolver = AffiliationResolver() if use_resolver else None
+    
+    def _observe_response(self, response):
+        """httpx响应钩子：把每个响应（包括SDK内部重试的429）的限流信息交给限制器"""
+        if response.status_code == 429:
+            self.limiter.on_rate_limited(parse_reset_seconds(response.headers.get("retry-after")))
+        else:
+            self.limiter.observe_headers(response.headers)
+    
+    def request_classification(self, content):
+        """调用OpenAI模型判断论文机构（级联模式下先用小模型），失败时抛出异常"""
+        return self.router.run(lambda model: self._request_classification(content, model))
+    
+    def _request_classification(self, content, model):
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[
+            {"role": "system", "content": CLASSIFICATION_PROMPT},
+            {"role": "user", "content": f"{content}"},
+            ],       
+            temperature=0.0
+        )
+        result = response.choices[0].message.content.strip()
+        if model != self.router.model:
+            # 小模型的输出必须是机构列表；回答Unknown时可能是漏看了机构，交给大模型确认
+            if result == "Unknown":
+                raise LowConfidence("小模型未能识别机构")
+            if not isinstance(json.loads(result), list):
+                raise ValueError(f"机构不是列表: {result}")
+        return result
     
     def classify_paper(self, content):
         """
@@ -33,41 +113,209 @@ class PaperAffiliationClassifier:
         返回:
             机构名称
         """
-        # 构建提示
-        prompt = f"""
-        Based on the following paper content, determine the author affiliation(s) strictly from the listed author information, such as university, company, or research institution. Do not infer affiliations based on the models, tools, or datasets used in the paper (e.g., mentioning OpenAI or GPT does not mean OpenAI is an author affiliation).
-        Please respond with only the organization name(s) from the author list, without any additional text. If author affiliations are not listed or are ambiguous, respond with "Unknown".
-        Format your response as follows:
-        ["Organization1", "Organization2", "Organization3", ...]
-        """
-        
         if not content:
             return "Error: No content provided"
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": f"{content}"},
-                ],       
-                temperature=0.0
-            )
-            
-            affiliation = response.choices[0].message.content.strip()
-            return affiliation
+            return self.request_classification(content)
         
         except Exception as e:
             logging.error(f"API调用失败: {str(e)}")
             return "Error"
     
-    def process_csv(self, input_csv):
+    def call_limited(self, func, *args):
+        """
+        在自适应并发限制下调用func；重试由大模型网关按Retry-After负责，
+        这里不再重试，异常直接抛出
+        """
+        with self.limiter:
+            result = func(*args)
+        self.limiter.on_success()
+        return result
+    
+    def classify_paper_limited(self, content):
+        """在自适应并发限制下分类单篇论文"""
+        if not content:
+            return "Error: No content provided"
+        
+        try:
+            return self.call_limited(self.request_classification, content)
+        except RateLimitError as e:
+            logging.error(f"API调用多次被限流: {str(e)}")
+            return "Error"
+        except Exception as e:
+            logging.error(f"API调用失败: {str(e)}")
+            return "Error"
+    
+    def classify_many(self, contents):
+        """
+        并发分类多篇论文
+        
+        参数:
+            contents: 键（行号或论文ID）到论文内容的字典
+            
+        返回:
+            按完成顺序产生(键, 机构)的生成器
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.limiter.max_limit) as executor:
+            future_to_key = {
+                executor.submit(self.classify_paper_limited, content): key
+                for key, content in contents.items()
+            }
+            for future in tqdm(concurrent.futures.as_completed(future_to_key),
+                               total=len(future_to_key), desc="并发分类论文"):
+                yield future_to_key[future], future.result()
+    
+    def request_batch_classification(self, batch):
+        """
+        在一个请求中分类一批论文，输出不合法时抛出ValueError
+        
+        参数:
+            batch: 键到论文内容的字典
+            
+        返回:
+            键到机构字符串的字典
+        """
+        return self.router.run(lambda model: self._request_batch_classification(batch, model))
+    
+    def _request_batch_classification(self, batch, model):
+        # 请求中使用短标签，避免行号或论文ID的格式影响输出
+        labels = {f"P{i + 1}": key for i, key in enumerate(batch)}
+        user_content = "\n\n".join(f"### Paper {label}\n{batch[key]}" for label, key in labels.items())
+        
+        request = dict(
+            model=model,
+            messages=[
+                {"role": "system", "content": BATCH_CLASSIFICATION_PROMPT},
+                {"role": "user", "content": user_content},
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.0
+        )
+        response = self.client.chat.completions.create(**request)
+        try:
+            return self._parse_batch_classification(response.choices[0].message.content, labels, model)
+        except LowConfidence:
+            raise
+        except VALIDATION_ERRORS as e:
+            # 不合法的回答不能留在缓存中，否则每次运行都会重放并再次拆分
+            self.client.chat.completions.invalidate(**request)
+            if isinstance(e, ValueError):
+                raise
+            raise ValueError(f"批量分类结果不合法: {str(e)}") from e
+    
+    def _parse_batch_classification(self, content, labels, model):
+        result = json.loads(content)
+        if not isinstance(result, dict) or set(result) != set(labels):
+            raise ValueError(f"批量分类结果的论文ID不匹配: {list(result)[:5] if isinstance(result, dict) else result}")
+        affiliations = {}
+        for label, key in labels.items():
+            value = result[label]
+            if isinstance(value, str):
+                value = [value]
+            if not isinstance(value, list):
+                raise ValueError(f"论文 {label} 的机构不是列表: {value}")
+            affiliations[key] = format_affiliations(value)
+        unknown = sum(1 for affiliation in affiliations.values() if affiliation == "Unknown")
+        if model != self.router.model and unknown * 2 > len(affiliations):
+            raise LowConfidence(f"小模型未能识别{unknown}/{len(affiliations)}篇论文的机构")
+        return affiliations
+    
+    def classify_batch(self, batch):
+        """
+        分类一批论文；结果校验失败时拆成两半分别重试，单篇时退回逐篇分类，
+        接口错误时整批标记为Error
+        
+        返回:
+            键到机构字符串的字典
+        """
+        if len(batch) == 1:
+            key, content = next(iter(batch.items()))
+            return {key: self.classify_paper_limited(content)}
+        
+        try:
+            return self.call_limited(self.request_batch_classification, batch)
+        except ValueError as e:
+            # 只有输出校验失败（包括JSON解析失败）时才拆分；接口错误拆分后只会更多地失败
+            logging.warning(f"批量分类{len(batch)}篇论文的结果不合法，拆分后重试: {str(e)}")
+            keys = list(batch)
+            middle = len(keys) // 2
+            result = self.classify_batch({key: batch[key] for key in keys[:middle]})
+            result.update(self.classify_batch({key: batch[key] for key in keys[middle:]}))
+            return result
+        except Exception as e:
+            logging.error(f"批量分类{len(batch)}篇论文的API调用失败: {str(e)}")
+            return {key: "Error" for key in batch}
+    
+    def classify_many_batched(self, contents, token_budget=24000, max_papers=20):
+        """
+        按token预算把多篇论文打包成批量请求并发分类
+        
+        参数:
+            contents: 键（行号或论文ID）到论文内容的字典
+            token_budget: 每批论文内容的token上限
+            max_papers: 每批最多的论文数
+            
+        返回:
+            按完成顺序产生(键, 机构)的生成器
+        """
+        valid = {key: content for key, content in contents.items() if isinstance(content, str) and content}
+        results = {key: "Error: No content provided" for key in contents if key not in valid}
+        for key, affiliation in results.items():
+            yield key, affiliation
+        
+        batches = make_batches(valid, token_budget, max_papers)
+        logging.info(f"{len(contents) - len(results)}篇论文打包为{len(batches)}个批量分类请求")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.limiter.max_limit) as executor:
+            futures = [executor.submit(self.classify_batch, batch) for batch in batches]
+            with tqdm(total=sum(len(batch) for batch in batches), desc="批量分类论文") as progress:
+                for future in concurrent.futures.as_completed(futures):
+                    batch_result = future.result()
+                    progress.update(len(batch_result))
+                    yield from batch_result.items()
+    
+    def classify_pending(self, pending_contents, author_counts=None, concurrent=True, batched=False):
+        """
+        分类待处理的论文：先用邮箱域名在本地解析，剩余论文交给模型
+        
+        参数:
+            pending_contents: 键到论文内容的字典
+            author_counts: 键到作者数量的字典，为None时不做本地解析
+            concurrent: 是否并发分类
+            batched: 是否把多篇论文打包到一个请求中分类
+            
+        返回:
+            产生(键, 机构)的生成器
+        """
+        if self.resolver is not None and author_counts is not None:
+            resolved, unresolved = self.resolver.resolve_many(
+                {key: (content, author_counts.get(key)) for key, content in pending_contents.items()}
+            )
+            yield from resolved.items()
+            pending_contents = {key: pending_contents[key] for key in unresolved}
+        
+        if batched:
+            yield from self.classify_many_batched(pending_contents)
+        elif concurrent:
+            yield from self.classify_many(pending_contents)
+        else:
+            for key, content in tqdm(pending_contents.items(), desc="处理论文"):
+                yield key, self.classify_paper(content)
+    
+    @staticmethod
+    def needs_classification(affiliation):
+        """判断论文是否还需要分类（没有机构信息或上次分类出错）"""
+        return pd.isna(affiliation) or affiliation == "" or affiliation == "Error"
+    
+    def process_csv(self, input_csv, save_every=20, concurrent=True, batched=False):
         """
         处理CSV文件，为每篇论文添加机构信息
         
         参数:
             input_csv: 输入CSV文件路径
-            batch_size: 每次处理的批次大小，用于控制API请求频率
+            save_every: 每分类多少篇论文保存一次进度，避免每篇都重写整个文件
+            concurrent: 是否并发分类
+            batched: 是否把多篇论文打包到一个请求中分类（同样并发执行）
         """
         try:
             # 读取CSV文件
@@ -77,34 +325,82 @@ class PaperAffiliationClassifier:
             # 添加机构列
             if "Affiliation" not in df.columns:
                 df["Affiliation"] = ""
+            df["Affiliation"] = df["Affiliation"].astype(object)
+            
+            # 如果已经有机构信息，跳过；有作者信息块时只发送作者信息块
+            has_author_block = "Author_Block" in df.columns
+            pending_contents = {
+                i: classification_input(df.at[i, "Author_Block"] if has_author_block else None, df.at[i, "Content"])
+                for i in range(len(df))
+                if self.needs_classification(df.at[i, "Affiliation"])
+            }
+            author_counts = ({i: count_authors(df.at[i, "Authors"]) for i in pending_contents}
+                             if "Authors" in df.columns else None)
+            results = self.classify_pending(pending_contents, author_counts, concurrent, batched)
             
             # 处理每篇论文
-            for i in tqdm(range(0, len(df)), desc="处理论文"):
-                # 如果已经有机构信息，跳过
-                if df.at[i, "Affiliation"] and df.at[i, "Affiliation"] != "Error":
-                    continue
-                
-                # 获取论文信息
-                content = df.at[i, "Content"]
-                
-                # 分类论文
-                affiliation = self.classify_paper(content)
+            pending = 0
+            for i, affiliation in results:
                 df.at[i, "Affiliation"] = affiliation
                 
-                # 直接保存到原文件
-                df.to_csv(input_csv, index=False)
+                # 定期保存进度
+                pending += 1
+                if pending >= save_every:
+                    df.to_csv(input_csv, index=False)
+                    pending = 0
             
-            # # 统计各机构论文数量
-            # affiliation_counts = df["Affiliation"].value_counts()
-            # logging.info("各机构论文数量统计:")
-            # for affiliation, count in affiliation_counts.items():
-            #     logging.info(f"{affiliation}: {count}篇")
+            df.to_csv(input_csv, index=False)
             
             return input_csv
             
         except Exception as e:
             logging.error(f"处理CSV文件失败: {str(e)}")
             raise
+    
+    def process_store(self, store, batch_size=20, concurrent=True, batched=False):
+        """
+        为论文存储中的论文添加机构信息，只读取需要分类的论文内容，并按批写回
+        
+        参数:
+            store: 论文存储（PaperStore）
+            batch_size: 每批写回结果的论文数
+            concurrent: 是否并发分类
+            batched: 是否把多篇论文打包到一个请求中分类（同样并发执行）
+        """
+        try:
+            df = store.read_columns(["Paper_ID", "Authors", "Affiliation", "Author_Block"])
+            logging.info(f"成功读取论文存储，共{len(df)}条记录")
+            
+            # 如果已经有机构信息，跳过
+            pending = df[df["Affiliation"].map(self.needs_classification)]
+            author_blocks = dict(zip(pending["Paper_ID"], pending["Author_Block"]))
+            # 只为没有可用作者信息块的论文加载第一页全文
+            fallback_ids = [paper_id for paper_id, block in author_blocks.items()
+                            if classification_input(block, None) is None]
+            contents = store.get_contents(fallback_ids)
+            pending_contents = {
+                paper_id: classification_input(block, contents.get(paper_id))
+                for paper_id, block in author_blocks.items()
+            }
+            logging.info(f"{len(pending_contents) - len(fallback_ids)}篇论文使用作者信息块分类，"
+                         f"{len(fallback_ids)}篇使用第一页全文")
+            author_counts = {paper_id: count_authors(authors)
+                             for paper_id, authors in zip(pending["Paper_ID"], pending["Authors"])}
+            results = self.classify_pending(pending_contents, author_counts, concurrent, batched)
+            
+            buffer = {}
+            for paper_id, affiliation in results:
+                buffer[paper_id] = affiliation
+                if len(buffer) >= batch_size:
+                    store.update_column("Affiliation", buffer)
+                    buffer = {}
+            store.update_column("Affiliation", buffer)
+            
+            return store
+            
+        except Exception as e:
+            logging.error(f"处理论文存储失败: {str(e)}")
+            raise
 
 def main():
     classifier = PaperAffiliationClassifier()
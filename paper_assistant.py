@@ -1,26 +1,75 @@
 import pandas as pd
 import os
 import json
+import queue
 import logging
+import threading
+import concurrent.futures
 import arxiv
 from tqdm import tqdm
-# 使用fitz库提取PDF文本
-from openai import OpenAI
-import fitz  # PyMuPDF
+from llm_cache import CachedChatClient
+from llm_gateway import get_gateway
+from priority_scheduler import get_scheduler
 # 导入html_extractor模块
 from html_extractor import get_image
+from pdf_cache import PdfCache
+from pdf_extraction_engine import get_engine
+from summary_store import SummaryStore
+from summary_input import build_summary_input
+from model_router import ModelRouter
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 生成失败时返回的摘要，不会被保存
+SUMMARY_FAILED = "无法生成摘要，请查看原文。"
+
+# 摘要必须包含的小节，级联模式下小模型的输出缺少任一小节时升级到大模型
+SUMMARY_LABELS = ["机构：", "整体内容：", "主要贡献：", "实现方法：", "实验与评估结果："]
+
 
 class PaperAssistant:
     """
     论文助手，用于根据筛选的索引下载相应论文，并生成每日精选论文摘要
     """
-    def __init__(self, output_dir="pdf_folder", image_dir="images"):
+    def __init__(self, output_dir="pdf_folder", image_dir="images", pdf_cache=None,
+                 max_workers=4, network_concurrency=3, cpu_concurrency=None, llm_concurrency=4,
+                 summary_model="gpt-4o", summary_store=None, input_token_budget=3000,
+                 fast_model=None, cascade=None):
+        """
+        参数:
+            output_dir: PDF下载目录
+            image_dir: 论文图片目录
+            pdf_cache: PDF缓存，为None时使用默认目录的PdfCache
+            max_workers: 同时处理的论文数
+            network_concurrency: 同时进行的下载（PDF、图片、arxiv查询）数
+            cpu_concurrency: 同时进行的PDF文本提取数，为None时使用CPU核数
+            llm_concurrency: 同时进行的大模型请求数
+            summary_model: 生成摘要使用的模型
+            summary_store: 摘要存储，为None时使用默认路径的SummaryStore，为False时不复用摘要
+            input_token_budget: 发送给模型的论文内容的token上限
+            fast_model: 级联模式下先尝试的小模型，为None时使用model_router.STAGE_MODELS中的配置
+            cascade: 是否开启级联（小模型的摘要格式不完整时再用summary_model），为None时使用默认配置
+        """
         self.output_dir = output_dir
         self.image_dir = image_dir
+        # PDF缓存，与arxiv_pdf的抓取阶段共用
+        self.pdf_cache = pdf_cache if pdf_cache is not None else PdfCache()
+        # 每类资源单独限制并发，避免多篇论文同时下载或同时请求模型
+        self.max_workers = max_workers
+        self.network_slots = threading.Semaphore(network_concurrency)
+        self.cpu_slots = threading.Semaphore(cpu_concurrency or os.cpu_count() or 1)
+        self.llm_slots = threading.Semaphore(llm_concurrency)
+        self.arxiv_lock = threading.Lock()
+        self.router = ModelRouter("summary", summary_model, fast_model, cascade)
+        self.summary_model = self.router.model
+        # 摘要存储按实际参与生成的模型组合区分
+        self.summary_key_model = ">".join(self.router.models())
+        self.input_token_budget = input_token_budget
+        # 已生成的摘要，与定时流水线共用
+        if summary_store is None:
+            summary_store = SummaryStore()
+        self.summary_store = summary_store or None
         # 创建输出目录（如果不存在）
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -31,7 +80,7 @@ class PaperAssistant:
         # 设置OpenAI API密钥
         
         self.api_key = os.environ["OPENAI_API_KEY"]
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = CachedChatClient(get_gateway())
         
         # 系统提示
         self.summary_system_prompt = """
@@ -63,119 +112,294 @@ class PaperAssistant:
             raise
     
 
+    def extract_papers_from_store(self, store, indices):
+        """从论文存储中按索引提取论文信息，只读取需要的列"""
+        try:
+            # 确保indices是列表类型
+            if not isinstance(indices, list):
+                raise ValueError("索引必须是列表格式")
+            
+            df = store.read_columns(["Title", "Affiliation", "Paper_ID", "URL"])
+            return df.iloc[indices]
+        
+        except Exception as e:
+            logging.error(f"提取论文信息失败: {str(e)}")
+            raise
+
+    def markdown_header(self):
+        """生成每日精选论文markdown的标题部分"""
+        markdown_content = "# 每日arxiv精选论文\n\n"
+        markdown_content += f"生成日期: {pd.Timestamp.now().strftime('%Y-%m-%d')}\n\n"
+        return markdown_content
+
+    def fetch_pdf(self, paper, client):
+        """
+        获取论文PDF，优先使用缓存
+
+        参数:
+            paper: 论文信息（包含Paper_ID和Title）
+            client: arxiv客户端
+
+        返回:
+            PDF文件路径
+        """
+        paper_id = paper["Paper_ID"]
+        title = paper["Title"]
+        filename = f"{title}.pdf"
+        filepath = os.path.join(self.output_dir, filename)
+        
+        # 检查缓存或文件是否已存在
+        cached_path = self.pdf_cache.get_pdf(paper_id)
+        if cached_path:
+            logging.info(f"论文已在缓存中，跳过下载: {paper_id}")
+            return cached_path
+        if os.path.exists(filepath):
+            logging.info(f"论文已存在，跳过下载: {filename}")
+            return filepath
+        
+        # 下载论文
+        logging.info(f"正在下载论文: {paper_id} - {title}")
+        with self.network_slots, get_scheduler().slot("download"):
+            # arxiv客户端的限速状态不是线程安全的，元数据查询串行执行以保持arXiv要求的请求间隔，
+            # PDF下载仍然并行
+            with self.arxiv_lock:
+                arxiv_paper = next(client.results(arxiv.Search(id_list=[paper_id])))
+            arxiv_paper.download_pdf(filename=filepath)
+        logging.info(f"成功下载论文: {filename}")
+        return self.pdf_cache.put_pdf(paper_id, filepath)
+
+    def render_images(self, paper_id):
+        """获取论文图片并生成对应的markdown"""
+        paper_content = ""
+        logging.info(f"正在获取论文图片: {paper_id}")
+        # 从paper_id中提取short_id (例如: 2503.16203v1)
+        with self.network_slots, get_scheduler().slot("download"):
+            img_count = get_image(paper_id, self.image_dir)
+        
+        # 添加图片到markdown
+        if img_count > 0:
+            # paper_content += "### 论文图片\n\n"
+            if img_count == 2:  # 如果有两张图片，将它们放在同一行
+                # 使用Markdown表格语法实现并排显示
+                img_paths = []
+                for i in range(img_count):
+                    for suffix in ["png", "jpg"]:
+                        img_path = f"{self.image_dir}/{paper_id}_{i}.{suffix}"
+                        if os.path.exists(img_path):
+                            img_paths.append(img_path)
+                            break
+                
+                if len(img_paths) == 2:
+                    paper_content += f"| ![图片1]({img_paths[0]}) | ![图片2]({img_paths[1]}) |\n"
+                    paper_content += "| --- | --- |\n\n"
+            else:  # 其他情况，每张图片单独一行
+                for i in range(img_count):
+                    for suffix in ["png", "jpg"]:
+                        img_path = f"{self.image_dir}/{paper_id}_{i}.{suffix}"
+                        if os.path.exists(img_path):
+                            paper_content += f"![图片{i+1}]({img_path})\n\n"
+                            break
+        return paper_content
+
+    def get_saved_summary(self, paper_id, text):
+        """返回已保存的摘要（同一论文版本、模型、系统提示和论文内容），不存在时返回None"""
+        if self.summary_store is None or not text.strip():
+            return None
+        return self.summary_store.get(paper_id, self.summary_key_model, self.summary_system_prompt, text)
+
+    def summarize_paper(self, paper, client, on_delta=None):
+        """
+        下载单篇论文、生成摘要和图片，返回该论文的markdown小节
+
+        参数:
+            paper: 论文信息（包含Paper_ID、Title、Affiliation和URL）
+            client: arxiv客户端
+            on_delta: 流式回调，摘要每生成一段就以当前的标题和部分摘要调用一次
+
+        返回:
+            markdown小节字符串
+        """
+        paper_id = paper["Paper_ID"]
+        title = paper["Title"]
+        affiliation = paper["Affiliation"]
+        url = paper["URL"]
+        heading = f"## [{title}]({url})\n\n"
+        
+        # PDF通常已在抓取阶段进入缓存；已保存的摘要按提取出的论文内容匹配，
+        # 重新提取的内容不同时重新生成并替换旧的摘要
+        filepath = self.fetch_pdf(paper, client)
+        text = self.summary_input(filepath)
+        summary = self.get_saved_summary(paper_id, text)
+        if summary is not None:
+            logging.info(f"使用已保存的论文摘要: {title}")
+            if on_delta is not None:
+                on_delta(heading + summary)
+        else:
+            # 生成论文摘要
+            logging.info(f"正在生成论文摘要: {title}")
+            partial = None if on_delta is None else (lambda part: on_delta(heading + part))
+            summary = self.generate_summary(filepath, title, affiliation, on_delta=partial, text=text)
+            # 只保存由非空论文内容生成的摘要
+            if summary != SUMMARY_FAILED and text.strip() and self.summary_store is not None:
+                self.summary_store.put(paper_id, self.summary_key_model, self.summary_system_prompt, text, summary)
+        
+        # 将摘要添加到markdown内容
+        paper_content = heading
+        paper_content += self.render_images(paper_id)
+        paper_content += f"{summary}\n\n"
+        paper_content += "---\n\n"
+        return paper_content
+
+    def iter_sections(self, papers_df, on_delta=None):
+        """
+        并行生成论文的markdown小节，按papers_df的顺序返回，单篇失败不影响其他论文
+
+        参数:
+            papers_df: 论文信息DataFrame
+            on_delta: 流式回调 on_delta(行索引, 部分小节)，为None时不使用流式生成；
+                      回调在调用方线程中执行，只针对下一篇待返回的论文
+
+        返回:
+            产生(行索引, markdown小节)的生成器，失败的论文不产生结果
+        """
+        client = arxiv.Client()
+        papers = list(papers_df.iterrows())
+        # 工作线程把部分摘要放入队列，由调用方线程转发给on_delta（Streamlit只能在主线程更新界面）
+        deltas = queue.Queue()
+        partials = {}
+        succeeded = 0
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            for position, (index, paper) in enumerate(papers):
+                callback = None if on_delta is None else (lambda text, position=position: deltas.put((position, text)))
+                futures.append(executor.submit(self.summarize_paper, paper, client, callback))
+            
+            try:
+                progress = tqdm(zip(papers, futures), total=len(papers), desc="下载论文")
+                for position, ((index, paper), future) in enumerate(progress):
+                    if on_delta is not None:
+                        if position in partials:
+                            on_delta(index, partials[position])
+                        while not future.done():
+                            try:
+                                delta_position, text = deltas.get(timeout=0.1)
+                            except queue.Empty:
+                                continue
+                            partials[delta_position] = text
+                            if delta_position == position:
+                                on_delta(index, text)
+                    try:
+                        section = future.result()
+                    except Exception as e:
+                        logging.error(f"处理论文失败 {paper['Paper_ID']}: {str(e)}")
+                        continue
+                    partials.pop(position, None)
+                    succeeded += 1
+                    yield index, section
+            finally:
+                # 调用方提前停止迭代时不再启动尚未开始的论文
+                for future in futures:
+                    future.cancel()
+        
+        logging.info(f"已成功处理 {succeeded}/{len(papers)} 篇论文")
+        if self.summary_store is not None:
+            self.summary_store.log_stats()
+        self.pdf_cache.evict()
+
+    def summarize_papers(self, papers_df):
+        """
+        逐篇生成论文的markdown小节，单篇失败不影响其他论文
+
+        参数:
+            papers_df: 论文信息DataFrame
+
+        返回:
+            与papers_df行索引对应的字典，失败的论文不包含在内
+        """
+        return dict(self.iter_sections(papers_df))
+
     def download_and_summarize(self, papers_df):
         if papers_df.empty:
             logging.warning("没有论文需要下载")
             return None
         
-        downloaded_count = 0
-        client = arxiv.Client()
+        sections = self.summarize_papers(papers_df)
         
         # 创建markdown内容
-        markdown_content = "# 每日arxiv精选论文\n\n"
-        markdown_content += f"生成日期: {pd.Timestamp.now().strftime('%Y-%m-%d')}\n\n"
-        
-        for _, paper in tqdm(papers_df.iterrows(), total=len(papers_df), desc="下载论文"):
-            try:
-                paper_id = paper["Paper_ID"]
-                title = paper["Title"]
-                affiliation = paper["Affiliation"]
-                url = paper["URL"]
-                
-                filename = f"{title}.pdf"
-                filepath = os.path.join(self.output_dir, filename)
-                
-                # 检查文件是否已存在
-                if os.path.exists(filepath):
-                    logging.info(f"论文已存在，跳过下载: {filename}")
-                    downloaded_count += 1
-                else:
-                    # 下载论文
-                    logging.info(f"正在下载论文: {paper_id} - {title}")
-                    arxiv_paper = next(client.results(arxiv.Search(id_list=[paper_id])))
-                    arxiv_paper.download_pdf(filename=filepath)
-                    logging.info(f"成功下载论文: {filename}")
-                    downloaded_count += 1
-                
-                # 生成论文摘要
-                logging.info(f"正在生成论文摘要: {title}")
-                summary = self.generate_summary(filepath, title, affiliation)
-                
-                # 将摘要添加到markdown内容
-                paper_content = f"## [{title}]({url})\n\n"
-                
-                # 获取论文图片
-                logging.info(f"正在获取论文图片: {paper_id}")
-                # 从paper_id中提取short_id (例如: 2503.16203v1)
-                img_count = get_image(paper_id, self.image_dir)
-                
-                # 添加图片到markdown
-                if img_count > 0:
-                    # paper_content += "### 论文图片\n\n"
-                    if img_count == 2:  # 如果有两张图片，将它们放在同一行
-                        # 使用Markdown表格语法实现并排显示
-                        img_paths = []
-                        for i in range(img_count):
-                            for suffix in ["png", "jpg"]:
-                                img_path = f"{self.image_dir}/{paper_id}_{i}.{suffix}"
-                                if os.path.exists(img_path):
-                                    img_paths.append(img_path)
-                                    break
-                        
-                        if len(img_paths) == 2:
-                            paper_content += f"| ![图片1]({img_paths[0]}) | ![图片2]({img_paths[1]}) |\n"
-                            paper_content += "| --- | --- |\n\n"
-                    else:  # 其他情况，每张图片单独一行
-                        for i in range(img_count):
-                            for suffix in ["png", "jpg"]:
-                                img_path = f"{self.image_dir}/{paper_id}_{i}.{suffix}"
-                                if os.path.exists(img_path):
-                                    paper_content += f"![图片{i+1}]({img_path})\n\n"
-                                    break
-                
-                paper_content += f"{summary}\n\n"
-                paper_content += "---\n\n"
-                
-                markdown_content += paper_content
-                
-            except Exception as e:
-                logging.error(f"处理论文失败 {paper_id}: {str(e)}")
-        
-        logging.info(f"已成功下载 {downloaded_count}/{len(papers_df)} 篇论文")
+        markdown_content = self.markdown_header()
+        for index in papers_df.index:
+            markdown_content += sections.get(index, "")
         
         return markdown_content
     
-    def generate_summary(self, pdf_path, title, affiliation):
-        """使用OpenAI模型生成论文摘要"""
+    def summary_input(self, pdf_path):
+        """
+        按章节提取前5页，挑选摘要、引言、方法、结果和结论并裁剪到token预算以内
+
+        返回:
+            发送给模型的论文内容，提取失败时为空字符串
+        """
         try:
-            # 提取PDF文本
-            text = ""
-            with fitz.open(pdf_path) as pdf_doc:
-                # 只读取前5页用于摘要
-                for page_num in range(min(5, len(pdf_doc))):
-                    page = pdf_doc[page_num]
-                    text += page.get_text("text") + "\n"
-            
-            # 限制文本长度以适应API限制
-            # text = text[:10000]  
-            
-            # 调用OpenAI API生成摘要，将机构信息与论文内容一起提供
-            response = self.client.chat.completions.create(
-                model="gpt-4o",  # 或者您选择的其他模型
-                messages=[
-                    {"role": "system", "content": self.summary_system_prompt},
-                    {"role": "user", "content": f"机构: {affiliation}\n\n论文内容: {text}"}
-                ],
-                max_tokens=500
-            )
+            with self.cpu_slots:
+                sections = get_engine().extract_sections(pdf_path, max_pages=5)
+            return build_summary_input(sections, self.input_token_budget, self.summary_model)
+        except Exception as e:
+            logging.error(f"提取摘要输入失败: {str(e)}")
+            return ""
+    
+    def generate_summary(self, pdf_path, title, affiliation, on_delta=None, text=None):
+        """
+        使用OpenAI模型生成论文摘要
+
+        参数:
+            on_delta: 流式回调，提供时以流式方式请求，每收到一段内容就以当前已生成的摘要调用一次
+            text: 已提取的论文内容，为None时从pdf_path提取
+        """
+        try:
+            if text is None:
+                text = self.summary_input(pdf_path)
+            # 提取失败时没有论文内容，不能让模型凭空编写摘要
+            if not text.strip():
+                raise ValueError(f"未能从PDF中提取到论文内容: {pdf_path}")
             
-            summary = response.choices[0].message.content
+            # 调用OpenAI API生成摘要，将机构信息与论文内容一起提供（级联模式下先用小模型）
+            user_content = f"机构: {affiliation}\n\n论文内容: {text}"
+            with self.llm_slots:
+                summary = self.router.run(lambda model: self.request_summary(user_content, model, on_delta))
             logging.info(f"成功生成论文摘要: {title}")
             return summary
             
         except Exception as e:
             logging.error(f"生成摘要失败: {str(e)}")
-            return "无法生成摘要，请查看原文。"
+            return SUMMARY_FAILED
+    
+    def request_summary(self, user_content, model, on_delta=None):
+        """请求模型生成摘要；级联的小模型输出缺少必需小节时抛出ValueError"""
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": self.summary_system_prompt},
+                {"role": "user", "content": user_content}
+            ],
+            max_tokens=500,
+            stream=on_delta is not None
+        )
+        
+        if on_delta is None:
+            summary = response.choices[0].message.content
+        else:
+            summary = ""
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    summary += chunk.choices[0].delta.content
+                    on_delta(summary)
+        
+        if model != self.router.model:
+            missing = [label for label in SUMMARY_LABELS if label not in summary]
+            if missing:
+                raise ValueError(f"摘要缺少小节: {missing}")
+        return summary
     
     def process_and_download(self, csv_path, indices):
         try:
@@ -192,6 +416,33 @@ class PaperAssistant:
             logging.error(f"处理和下载论文失败: {str(e)}")
             raise
 
+    def process_store_and_download(self, store, indices):
+        try:
+            papers_df = self.extract_papers_from_store(store, indices)
+            return self.download_and_summarize(papers_df)
+        
+        except Exception as e:
+            logging.error(f"处理和下载论文失败: {str(e)}")
+            raise
+
+    def stream_store_sections(self, store, indices, on_delta=None):
+        """
+        流式生成论文存储中指定论文的markdown小节，供界面逐篇显示
+
+        参数:
+            store: 论文存储（PaperStore）
+            indices: 论文索引列表
+            on_delta: 流式回调 on_delta(行索引, 部分小节)
+
+        返回:
+            按索引顺序产生(行索引, markdown小节)的生成器
+        """
+        papers_df = self.extract_papers_from_store(store, indices)
+        if papers_df.empty:
+            logging.warning("没有论文需要下载")
+            return
+        yield from self.iter_sections(papers_df, on_delta)
+
 def main():
     # 从affiliation_analyzer.py获取的索引结果
     indices_result = "[0, 5, 10, 15]"  # 示例索引，请替换为实际结果
@@ -2,33 +2,51 @@ import os
 import datetime as dt
 import time
 import schedule
+import pandas as pd
 import arxiv_pdf
 import paper_affiliation_classifier
 import affiliation_analyzer
-from paper_assistant import PaperAssistant
+from paper_assistant import PaperAssistant, SUMMARY_FAILED
 from orgs import orgs
 from tools import clean_folder
+from fetch_watermark import FetchWatermark, base_paper_id
+from paper_store import PaperStore
+from llm_cache import get_default_cache
+from model_router import log_stage_stats
+from llm_gateway import get_gateway
+from priority_scheduler import get_scheduler, set_process_priority
 
-def run_pipeline(csv_filename="papers.csv",
+MARKDOWN_FILENAME = "每日默认精选论文.md"
+# 定时任务是否使用增量模式
+INCREMENTAL = True
+
+def run_pipeline(db_path="papers.db",
                 pdf_folder="pdf_folder",
                 query="cat:cs.AI", 
                 author_filter=False,
                 days_back=1,
-                target_orgs=None):
+                target_orgs=None,
+                incremental=False,
+                corpus_filename="papers_corpus.csv"):
     """
     运行完整的论文处理流水线
     
     参数:
-        csv_filename: CSV文件名（保存在当前目录）
+        db_path: 论文存储（SQLite）文件路径
         pdf_folder: PDF文件保存文件夹
         query: arXiv查询字符串
         author_filter: 是否使用作者过滤
         days_back: 往前查询的天数
         target_orgs: 目标机构列表
+        incremental: 是否使用增量模式（只处理水位线之后的新论文）
+        corpus_filename: 增量模式下累积的论文语料CSV文件
         
     返回:
         下载的论文数量
     """
+    if incremental:
+        return run_incremental_pipeline(db_path, corpus_filename, pdf_folder, query,
+                                        author_filter, days_back, target_orgs)
     try:
         # 清空pdf_folder和images文件夹
         clean_folder("pdf_folder")
@@ -45,13 +63,14 @@ def run_pipeline(csv_filename="papers.csv",
         
         # 2. 使用arxiv_pdf模块获取论文列表
         print("第1步: 从arXiv获取论文列表...")
+        store = PaperStore(db_path)
         papers_count = arxiv_pdf.fetch_papers(
             pdf_folder, 
-            csv_filename=csv_filename,
             query=query,
             author_filter=author_filter,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            store=store
         )
         
         if papers_count == 0:
@@ -63,21 +82,21 @@ def run_pipeline(csv_filename="papers.csv",
         # 3. 使用paper_affiliation_classifier模块分类论文机构
         print("第2步: 模型分类论文机构...")
         classifier = paper_affiliation_classifier.PaperAffiliationClassifier()
-        classifier.process_csv(csv_filename)
+        classifier.process_store(store, batched=True)
         print("论文机构分类完成")
         
         # 4. 使用affiliation_analyzer模块分析机构
         print("第3步: 模型筛选目标机构论文...")
         analyzer = affiliation_analyzer.AffiliationAnalyzer()
-        indices_result = analyzer.process_csv(csv_filename, target_orgs)
+        indices_result = analyzer.process_store(store, target_orgs)
         print(f"机构分析完成，找到的索引: {indices_result}")
          # 第四步：下载论文并生成摘要
         print("第4步: 生成图文摘要...")
         assistant = PaperAssistant(output_dir=pdf_folder, image_dir="default_images")
-        markdown_content = assistant.process_and_download(csv_filename, indices_result)
+        markdown_content = assistant.process_store_and_download(store, indices_result)
         
         # 将内容写入markdown文件
-        markdown_filename = "每日默认精选论文.md"
+        markdown_filename = MARKDOWN_FILENAME
         with open(markdown_filename, "w", encoding="utf-8") as f:
             f.write(markdown_content)
         
@@ -86,6 +105,10 @@ def run_pipeline(csv_filename="papers.csv",
         # 6. 输出结果摘要
         print("=== 论文处理流水线完成 ===")
         print(f"- 获取论文数量: {papers_count}")
+        get_default_cache().log_stats()
+        log_stage_stats()
+        get_gateway().log_stats()
+        get_scheduler().log_stats()
         
         return papers_count
         
@@ -95,6 +118,151 @@ def run_pipeline(csv_filename="papers.csv",
         print(traceback.format_exc())
         return 0
 
+def merge_into_corpus(corpus_filename, new_df, window_start):
+    """
+    将新论文合并到累积语料中，按论文ID（去版本号）去重，并删除超出时间窗口的论文
+    
+    参数:
+        corpus_filename: 语料CSV文件
+        new_df: 新论文DataFrame
+        window_start: 保留窗口的开始时间（UTC），应与arXiv查询使用的开始时间一致
+        
+    返回:
+        合并后的DataFrame
+    """
+    if os.path.exists(corpus_filename):
+        corpus_df = pd.read_csv(corpus_filename)
+        merged = pd.concat([new_df, corpus_df], ignore_index=True)
+    else:
+        merged = new_df.copy()
+    
+    # 新论文在前，去重时保留新的版本
+    merged["_base_id"] = merged["Paper_ID"].map(base_paper_id)
+    merged = merged.drop_duplicates(subset="_base_id", keep="first").drop(columns="_base_id")
+    
+    # 删除超出时间窗口的论文；本次新获取的论文已经被水位线记录，始终保留
+    cutoff = pd.Timestamp(window_start, tz="UTC")
+    dates = pd.to_datetime(merged["Date"], utc=True, errors="coerce")
+    is_new = merged["Paper_ID"].isin(new_df["Paper_ID"])
+    merged = merged[is_new | dates.isna() | (dates >= cutoff)].reset_index(drop=True)
+    
+    merged.to_csv(corpus_filename, index=False)
+    return merged
+
+def prune_images(image_dir, paper_ids):
+    """删除不属于当前语料的论文图片"""
+    if not os.path.exists(image_dir):
+        return
+    keep = set(paper_ids)
+    for name in os.listdir(image_dir):
+        paper_id = name.rsplit("_", 1)[0]
+        if paper_id not in keep:
+            os.remove(os.path.join(image_dir, name))
+
+def run_incremental_pipeline(db_path="papers.db",
+                             corpus_filename="papers_corpus.csv",
+                             pdf_folder="pdf_folder",
+                             query="cat:cs.AI",
+                             author_filter=False,
+                             days_back=1,
+                             target_orgs=None,
+                             image_dir="default_images"):
+    """
+    增量运行论文处理流水线：只对水位线之后的新论文执行下载、分类和摘要，
+    结果合并到累积语料后重新生成每日精选论文
+    
+    返回:
+        本次新处理的论文数量
+    """
+    try:
+        clean_folder(pdf_folder)
+        os.makedirs(image_dir, exist_ok=True)
+        
+        if target_orgs is None:
+            target_orgs = orgs
+        
+        watermark = FetchWatermark()
+        end_date = dt.datetime.today()
+        window_start = end_date - dt.timedelta(days=days_back)
+        start_date = watermark.start_date(window_start)
+        print(f"增量模式，使用日期范围: {start_date.strftime('%Y-%m-%d %H:%M')} 到 {end_date.strftime('%Y-%m-%d %H:%M')}")
+        
+        print("第1步: 从arXiv获取新论文...")
+        store = PaperStore(db_path)
+        papers_count = arxiv_pdf.fetch_papers(
+            pdf_folder,
+            query=query,
+            author_filter=author_filter,
+            start_date=start_date,
+            end_date=end_date,
+            watermark=watermark,
+            store=store
+        )
+        
+        if papers_count == 0:
+            print("没有新论文，保留现有的每日精选论文")
+            return 0
+        
+        print("第2步: 模型分类新论文机构...")
+        classifier = paper_affiliation_classifier.PaperAffiliationClassifier()
+        classifier.process_store(store, batched=True)
+        
+        print("第3步: 模型筛选新论文中的目标机构论文...")
+        analyzer = affiliation_analyzer.AffiliationAnalyzer()
+        indices_result = analyzer.process_store(store, target_orgs)
+        
+        new_df = store.read_columns(["Paper_ID", "Title", "Authors", "Abstract", "Primary Category",
+                                     "Categories", "URL", "Date", "Affiliation"])
+        new_df["Target_Match"] = False
+        new_df.loc[new_df.index.isin(indices_result), "Target_Match"] = True
+        
+        print("第4步: 为新的目标机构论文生成图文摘要...")
+        new_df["Digest_Section"] = ""
+        assistant = PaperAssistant(output_dir=pdf_folder, image_dir=image_dir)
+        targets = new_df[new_df["Target_Match"]]
+        if not targets.empty:
+            sections = assistant.summarize_papers(targets[["Title", "Affiliation", "Paper_ID", "URL"]])
+            for index, section in sections.items():
+                new_df.at[index, "Digest_Section"] = section
+        
+        # 合并到累积语料并记录水位线
+        corpus_df = merge_into_corpus(corpus_filename, new_df,
+                                      arxiv_pdf.query_window_start(window_start))
+        # 下载失败（没有内容）和目标论文摘要生成失败的论文不记录，下次运行时重试
+        contents = store.get_contents(new_df["Paper_ID"])
+        dates = pd.to_datetime(new_df["Date"], utc=True, errors="coerce")
+        summary_failed = new_df["Target_Match"] & (
+            (new_df["Digest_Section"] == "") | new_df["Digest_Section"].str.contains(SUMMARY_FAILED, regex=False)
+        )
+        for paper_id, date, failed in zip(new_df["Paper_ID"], dates, summary_failed):
+            if not pd.isna(date) and contents.get(paper_id) and not failed:
+                watermark.update(paper_id, date.to_pydatetime())
+        watermark.save()
+        
+        # 从合并后的语料重新生成每日精选论文
+        corpus_df["Digest_Section"] = corpus_df["Digest_Section"].fillna("")
+        digest = corpus_df[corpus_df["Target_Match"].astype(bool) & (corpus_df["Digest_Section"] != "")]
+        markdown_content = assistant.markdown_header() + "".join(digest["Digest_Section"])
+        with open(MARKDOWN_FILENAME, "w", encoding="utf-8") as f:
+            f.write(markdown_content)
+        prune_images(image_dir, corpus_df["Paper_ID"])
+        
+        print(f"已将论文摘要保存到 {MARKDOWN_FILENAME}")
+        print("=== 增量论文处理流水线完成 ===")
+        print(f"- 新论文数量: {papers_count}，语料论文数量: {len(corpus_df)}，精选论文数量: {len(digest)}")
+        get_default_cache().log_stats()
+        log_stage_stats()
+        get_gateway().log_stats()
+        get_scheduler().log_stats()
+        
+        return papers_count
+        
+    except Exception as e:
+        print(f"增量论文处理流水线运行失败: {str(e)}")
+        import traceback
+        print(traceback.format_exc())
+        return 0
+
 def run_scheduled_pipeline():
     """运行计划任务的包装函数，记录运行时间"""
     # 每次运行时清空日志文件
@@ -103,7 +271,7 @@ def run_scheduled_pipeline():
         log_file.write(f"[{current_time}] 开始执行计划任务...\n")
     
     print(f"\n[{current_time}] 开始执行计划任务...")
-    run_pipeline()
+    run_pipeline(incremental=INCREMENTAL)
     
     # 记录完成时间
     with open("pipeline.log", "a") as log_file:
@@ -142,6 +310,8 @@ def schedule_pipeline():
 
 def main():
     """主函数"""
+    # 后台流水线使用低优先级，界面上的请求可以越过它排队中的大模型和下载请求
+    set_process_priority("background")
     # 直接调用schedule_pipeline函数
     schedule_pipeline()
 
@@ -0,0 +1,225 @@
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+DEFAULT_DB_PATH = "papers.db"
+
+# CSV列名与数据库列名的对应关系（Content单独存放在contents表中）
+COLUMNS = {
+    "Paper_ID": "paper_id",
+    "Title": "title",
+    "Authors": "authors",
+    "Abstract": "abstract",
+    "Primary Category": "primary_category",
+    "Categories": "categories",
+    "URL": "url",
+    "Date": "date",
+    "Affiliation": "affiliation",
+    "Author_Block": "author_block",
+}
+CONTENT_COLUMN = "Content"
+
+
+class PaperStore:
+    """
+    基于SQLite的论文存储，替代papers.csv：
+    支持批量写入、只读取需要的列，Content存放在单独的表中按需加载
+    """
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        """
+        参数:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._init_schema()
+
+    @contextmanager
+    def _connect(self):
+        """打开一个连接，正常退出时提交事务，结束后关闭连接"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _init_schema(self):
+        columns = ", ".join(f"{name} TEXT" for name in COLUMNS.values() if name != "paper_id")
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS papers ("
+                f"row_index INTEGER NOT NULL, paper_id TEXT PRIMARY KEY, {columns})"
+            )
+            # 旧数据库中缺少的列（例如后来加入的Author_Block）
+            existing = set(self._table_columns(conn))
+            for name in COLUMNS.values():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE papers ADD COLUMN {name} TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_row ON papers(row_index)")
+            conn.execute("CREATE TABLE IF NOT EXISTS contents (paper_id TEXT PRIMARY KEY, content TEXT)")
+
+    def ensure_column(self, column):
+        """为papers表添加额外的列（例如后续阶段写入的字段），列名使用CSV风格"""
+        name = self.column_name(column)
+        with self.lock, self._connect() as conn:
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(papers)")}
+            if name not in existing:
+                conn.execute(f"ALTER TABLE papers ADD COLUMN {name} TEXT")
+        return name
+
+    @staticmethod
+    def column_name(column):
+        return COLUMNS.get(column, column.lower().replace(" ", "_"))
+
+    def _table_columns(self, conn):
+        return [row[1] for row in conn.execute("PRAGMA table_info(papers)")]
+
+    def clear(self):
+        """删除所有论文"""
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM papers")
+            conn.execute("DELETE FROM contents")
+
+    def upsert_papers(self, records):
+        """
+        批量写入论文，已存在的论文更新字段并保留原有顺序
+
+        参数:
+            records: 字典列表，键为CSV列名，可以包含Content
+        """
+        if not records:
+            return
+        with self.lock, self._connect() as conn:
+            self._upsert(conn, records)
+        logging.info(f"批量写入{len(records)}篇论文")
+
+    def _upsert(self, conn, records):
+        """在调用方的事务中写入论文"""
+        table_columns = set(self._table_columns(conn))
+        next_index = conn.execute("SELECT COALESCE(MAX(row_index) + 1, 0) FROM papers").fetchone()[0]
+        content_rows = []
+        for record in records:
+            paper_id = str(record["Paper_ID"])
+            fields = {}
+            for key, value in record.items():
+                if key == CONTENT_COLUMN:
+                    content_rows.append((paper_id, "" if value is None else str(value)))
+                    continue
+                name = self.column_name(key)
+                if name in table_columns and name != "paper_id":
+                    fields[name] = None if value is None else str(value)
+            names = ["row_index", "paper_id"] + list(fields)
+            placeholders = ", ".join("?" for _ in names)
+            updates = ", ".join(f"{name} = excluded.{name}" for name in fields) or "paper_id = paper_id"
+            conn.execute(
+                f"INSERT INTO papers ({', '.join(names)}) VALUES ({placeholders}) "
+                f"ON CONFLICT(paper_id) DO UPDATE SET {updates}",
+                [next_index, paper_id] + list(fields.values())
+            )
+            next_index += 1
+        if content_rows:
+            conn.executemany(
+                "INSERT INTO contents (paper_id, content) VALUES (?, ?) "
+                "ON CONFLICT(paper_id) DO UPDATE SET content = excluded.content",
+                content_rows
+            )
+
+    def replace_all(self, records):
+        """
+        清空后写入论文，对应一次全新的抓取；删除和写入在同一个事务中完成，
+        共用数据库的其他进程不会读到空的存储
+        """
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM papers")
+            conn.execute("DELETE FROM contents")
+            self._upsert(conn, records)
+        logging.info(f"替换写入{len(records)}篇论文")
+
+    def update_column(self, column, values):
+        """
+        批量更新某一列
+
+        参数:
+            column: CSV风格的列名
+            values: 论文ID到值的字典
+        """
+        if not values:
+            return
+        name = self.ensure_column(column)
+        with self.lock, self._connect() as conn:
+            conn.executemany(
+                f"UPDATE papers SET {name} = ? WHERE paper_id = ?",
+                [(None if value is None else str(value), str(paper_id)) for paper_id, value in values.items()]
+            )
+
+    def read_columns(self, columns=None):
+        """
+        按写入顺序读取指定列
+
+        参数:
+            columns: CSV风格的列名列表，为None时读取除Content外的所有列
+
+        返回:
+            DataFrame，行索引从0开始，与原CSV的行号一致
+        """
+        with self._connect() as conn:
+            table_columns = self._table_columns(conn)
+            if columns is None:
+                names = [name for name in table_columns if name != "row_index"]
+                reverse = {v: k for k, v in COLUMNS.items()}
+                labels = [reverse.get(name, name) for name in names]
+            else:
+                names = [self.column_name(column) for column in columns]
+                missing = [name for name in names if name not in table_columns]
+                if missing:
+                    raise ValueError(f"论文存储中不存在列: {missing}")
+                labels = list(columns)
+            rows = conn.execute(
+                f"SELECT {', '.join(names)} FROM papers ORDER BY row_index"
+            ).fetchall()
+        return pd.DataFrame(rows, columns=labels)
+
+    def get_contents(self, paper_ids):
+        """
+        按需加载论文的第一页内容
+
+        返回:
+            论文ID到内容的字典
+        """
+        paper_ids = [str(paper_id) for paper_id in paper_ids]
+        contents = {}
+        with self._connect() as conn:
+            # SQLite对参数数量有限制，分批查询
+            for start in range(0, len(paper_ids), 500):
+                batch = paper_ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                for paper_id, content in conn.execute(
+                    f"SELECT paper_id, content FROM contents WHERE paper_id IN ({placeholders})", batch
+                ):
+                    contents[paper_id] = content
+        return contents
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+    def import_csv(self, csv_path):
+        """从旧的CSV文件导入论文"""
+        df = pd.read_csv(csv_path)
+        df = df.astype(object).where(pd.notna(df), None)
+        self.replace_all(df.to_dict("records"))
+
+    def export_csv(self, csv_path, include_content=False):
+        """导出为CSV文件，便于查看"""
+        df = self.read_columns()
+        if include_content:
+            contents = self.get_contents(df["Paper_ID"])
+            df[CONTENT_COLUMN] = df["Paper_ID"].map(contents)
+        df.to_csv(csv_path, index=False)
@@ -0,0 +1,160 @@
+import os
+import shutil
+import time
+import logging
+
+DEFAULT_CACHE_DIR = "pdf_cache"
+
+
+class PdfCache:
+    """
+    按arXiv ID（含版本号）索引的本地PDF缓存，同时保存原始PDF、第一页文本和作者信息块，
+    按最近访问时间做LRU淘汰，并限制总大小和最长闲置时间
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=2 * 1024 ** 3, max_age_days=14):
+        """
+        参数:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            max_age_days: 条目最长闲置天数，超过后被淘汰
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 3600
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(paper_id):
+        """将论文ID转换为缓存键，旧式ID（如 hep-th/9901001v1）中的斜杠替换为下划线"""
+        return str(paper_id).strip().replace("/", "_")
+
+    def pdf_path(self, paper_id):
+        return os.path.join(self.cache_dir, f"{self.key(paper_id)}.pdf")
+
+    def text_path(self, paper_id):
+        return os.path.join(self.cache_dir, f"{self.key(paper_id)}.txt")
+
+    def author_block_path(self, paper_id):
+        return os.path.join(self.cache_dir, f"{self.key(paper_id)}.authors")
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def get_pdf(self, paper_id):
+        """返回缓存中的PDF路径，不存在时返回None"""
+        path = self.pdf_path(paper_id)
+        if os.path.exists(path):
+            self._touch(path)
+            return path
+        return None
+
+    def put_pdf(self, paper_id, src_path):
+        """
+        将已下载的PDF移动到缓存中
+
+        返回:
+            缓存中的PDF路径
+        """
+        path = self.pdf_path(paper_id)
+        tmp_path = path + ".tmp"
+        shutil.move(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def put_pdf_bytes(self, paper_id, data):
+        """
+        将内存中的PDF内容写入缓存
+
+        返回:
+            缓存中的PDF路径
+        """
+        path = self.pdf_path(paper_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def get_text(self, paper_id):
+        """返回缓存中的第一页文本，不存在时返回None"""
+        return self._read_text(paper_id, self.text_path(paper_id))
+
+    def get_author_block(self, paper_id):
+        """返回缓存中的作者信息块，不存在时返回None"""
+        return self._read_text(paper_id, self.author_block_path(paper_id))
+
+    def _read_text(self, paper_id, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError as e:
+            logging.warning(f"读取缓存文本失败 {paper_id}: {str(e)}")
+            return None
+        self._touch(path)
+        pdf = self.pdf_path(paper_id)
+        if os.path.exists(pdf):
+            self._touch(pdf)
+        return text
+
+    def put_text(self, paper_id, text):
+        """保存第一页文本，空文本不缓存"""
+        self._write_text(self.text_path(paper_id), text)
+
+    def put_author_block(self, paper_id, text):
+        """保存作者信息块，空文本不缓存"""
+        self._write_text(self.author_block_path(paper_id), text)
+
+    def _write_text(self, path, text):
+        if not text:
+            return
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        淘汰过期条目，并按最近访问时间从旧到新删除条目直到总大小不超过上限
+
+        返回:
+            被删除的条目数
+        """
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isfile(path):
+                continue
+            key = name.rsplit(".", 1)[0]
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = entries.setdefault(key, {"paths": [], "size": 0, "mtime": 0.0})
+            entry["paths"].append(path)
+            entry["size"] += st.st_size
+            entry["mtime"] = max(entry["mtime"], st.st_mtime)
+
+        now = time.time()
+        total = sum(e["size"] for e in entries.values())
+        removed = 0
+        # 最久未访问的条目排在前面
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["mtime"]):
+            expired = now - entry["mtime"] > self.max_age
+            if not expired and total <= self.max_bytes:
+                break
+            for path in entry["paths"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= entry["size"]
+            removed += 1
+
+        if removed:
+            logging.info(f"PDF缓存淘汰了{removed}个条目，当前大小{total / 1024 ** 2:.1f}MB")
+        return removed
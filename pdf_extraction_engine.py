@@ -0,0 +1,329 @@
+import os
+import re
+import atexit
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+
+
+def extract_text(pdf_path=None, stream=None, max_pages=1):
+    """
+    从PDF中提取前max_pages页的文本，多页之间用换行分隔
+
+    参数:
+        pdf_path: PDF文件路径
+        stream: PDF字节内容，提供时直接从内存读取
+        max_pages: 提取的最大页数
+
+    返回:
+        提取的文本，失败时返回空字符串
+    """
+    source = pdf_path if stream is None else "<内存>"
+    try:
+        if stream is not None:
+            pdf_doc = fitz.open(stream=stream, filetype="pdf")
+        else:
+            pdf_doc = fitz.open(pdf_path)
+        with pdf_doc:
+            if len(pdf_doc) == 0:
+                logging.warning(f"PDF文件 {source} 没有页面")
+                return ""
+            pages = [pdf_doc[i].get_text("text") for i in range(min(max_pages, len(pdf_doc)))]
+            return "\n".join(pages)
+    except Exception as e:
+        logging.error(f"PDF内容提取失败 {source}: {str(e)}")
+        return ""
+
+
+# 也能匹配 {alice,bob}@example.com 这种合并写法
+EMAIL_PATTERN = re.compile(r"@[\w-]+(\.[\w-]+)+")
+ABSTRACT_PATTERN = re.compile(r"^\s*(abstract|a b s t r a c t)\b", re.IGNORECASE)
+INTRODUCTION_PATTERN = re.compile(r"^\s*(1\.?|I\.)?\s*introduction\b", re.IGNORECASE)
+MAX_AUTHOR_BLOCK_CHARS = 3000
+
+
+def _page_lines(page):
+    """
+    返回页面中水平方向的文本行，每行包含文本、位置、最大字号和是否加粗
+    （arXiv左侧竖排的编号等非水平文本会被忽略）
+    """
+    lines = []
+    for block in page.get_text("dict")["blocks"]:
+        if block.get("type") != 0:
+            continue
+        for line in block["lines"]:
+            if abs(line["dir"][1]) > 0.1:
+                continue
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if not text:
+                continue
+            size = max(span["size"] for span in line["spans"])
+            bold = all(span["flags"] & 16 or "bold" in span["font"].lower()
+                       for span in line["spans"] if span["text"].strip())
+            lines.append({"text": text, "y0": line["bbox"][1], "y1": line["bbox"][3], "size": size, "bold": bold})
+    lines.sort(key=lambda line: line["y0"])
+    return lines
+
+
+def extract_author_block(page):
+    """
+    基于文本块的字号和位置提取标题、作者和机构信息：
+    取"Abstract"（或引言标题）之前的内容，加上页面底部小字号脚注中的机构和邮箱行
+
+    参数:
+        page: PyMuPDF的页面对象
+
+    返回:
+        作者和机构信息文本，无法识别时返回空字符串
+    """
+    lines = _page_lines(page)
+    if not lines:
+        return ""
+    height = page.rect.height
+
+    # 正文字号取所有行字号的中位数
+    sizes = sorted(line["size"] for line in lines)
+    body_size = sizes[len(sizes) // 2]
+
+    # 页眉区域：Abstract或引言标题之前，找不到时取页面上部35%
+    header_end = height * 0.35
+    for line in lines:
+        if ABSTRACT_PATTERN.match(line["text"]) or INTRODUCTION_PATTERN.match(line["text"]):
+            header_end = line["y0"]
+            break
+    selected = [line["text"] for line in lines if line["y1"] <= header_end + 1]
+
+    # 脚注区域：页面底部25%中字号小于正文的行，或任何包含邮箱的行
+    for line in lines:
+        if line["y1"] <= header_end + 1:
+            continue
+        in_footnote = line["y0"] >= height * 0.75 and line["size"] < body_size * 0.95
+        if in_footnote or EMAIL_PATTERN.search(line["text"]):
+            selected.append(line["text"])
+
+    return "\n".join(selected)[:MAX_AUTHOR_BLOCK_CHARS]
+
+
+def extract_first_page(pdf_path=None, stream=None):
+    """
+    提取第一页的全文和作者信息块
+
+    返回:
+        {"Content": 第一页文本, "Author_Block": 作者信息块}，失败时两者都为空字符串
+    """
+    source = pdf_path if stream is None else "<内存>"
+    try:
+        if stream is not None:
+            pdf_doc = fitz.open(stream=stream, filetype="pdf")
+        else:
+            pdf_doc = fitz.open(pdf_path)
+        with pdf_doc:
+            if len(pdf_doc) == 0:
+                logging.warning(f"PDF文件 {source} 没有页面")
+                return {"Content": "", "Author_Block": ""}
+            page = pdf_doc[0]
+            content = page.get_text("text")
+            try:
+                author_block = extract_author_block(page)
+            except Exception as e:
+                logging.warning(f"作者信息提取失败 {source}: {str(e)}")
+                author_block = ""
+            return {"Content": content, "Author_Block": author_block}
+    except Exception as e:
+        logging.error(f"PDF内容提取失败 {source}: {str(e)}")
+        return {"Content": "", "Author_Block": ""}
+
+
+NUMBERED_HEADING_PATTERN = re.compile(r"^(\d+(\.\d+)*\.?|[IVX]+\.|[A-H]\.)\s+[A-Z]")
+KNOWN_HEADING_PATTERN = re.compile(
+    r"^((\d+(\.\d+)*\.?|[IVX]+\.)\s*)?(abstract|introduction|related work|background|conclusions?|"
+    r"experiments?|results|evaluation|discussion|references|acknowledge?ments?)\s*$",
+    re.IGNORECASE
+)
+
+
+def _is_heading(line, body_size):
+    """根据字号、加粗和编号判断一行是否为章节标题"""
+    text = line["text"]
+    if len(text) > 80 or (text.endswith((".", ",", ";")) and not NUMBERED_HEADING_PATTERN.match(text)):
+        return False
+    if KNOWN_HEADING_PATTERN.match(text):
+        return True
+    if line["size"] >= body_size * 1.15 and NUMBERED_HEADING_PATTERN.match(text):
+        return True
+    return line["bold"] and line["size"] >= body_size * 0.95 and bool(NUMBERED_HEADING_PATTERN.match(text))
+
+
+def extract_sections(pdf_path=None, stream=None, max_pages=5):
+    """
+    按章节标题切分PDF前max_pages页的文本
+
+    返回:
+        [(标题, 正文), ...]，第一个元素的标题为空字符串，对应标题之前的内容（题目、作者等）；
+        失败时返回空列表，调用方应把空列表视为提取失败
+    """
+    source = pdf_path if stream is None else "<内存>"
+    try:
+        if stream is not None:
+            pdf_doc = fitz.open(stream=stream, filetype="pdf")
+        else:
+            pdf_doc = fitz.open(pdf_path)
+        with pdf_doc:
+            lines = []
+            for i in range(min(max_pages, len(pdf_doc))):
+                lines.extend(_page_lines(pdf_doc[i]))
+    except Exception as e:
+        logging.error(f"PDF章节提取失败 {source}: {str(e)}")
+        return []
+    if not lines:
+        return []
+
+    # 正文字号取按字符数加权的中位数
+    weighted = sorted((line["size"], len(line["text"])) for line in lines)
+    half, seen = sum(n for _, n in weighted) / 2, 0
+    body_size = weighted[-1][0]
+    for size, n in weighted:
+        seen += n
+        if seen >= half:
+            body_size = size
+            break
+
+    sections = [["", []]]
+    for line in lines:
+        if _is_heading(line, body_size):
+            sections.append([line["text"], []])
+        else:
+            sections[-1][1].append(line["text"])
+    return [(heading, "\n".join(body)) for heading, body in sections if heading or body]
+
+
+def _sections_task(args):
+    source, max_pages = args
+    if isinstance(source, (bytes, bytearray)):
+        return extract_sections(stream=source, max_pages=max_pages)
+    return extract_sections(pdf_path=source, max_pages=max_pages)
+
+
+def _first_page_task(source):
+    if isinstance(source, (bytes, bytearray)):
+        return extract_first_page(stream=source)
+    return extract_first_page(pdf_path=source)
+
+
+def _extract_task(args):
+    source, max_pages = args
+    if isinstance(source, (bytes, bytearray)):
+        return extract_text(stream=source, max_pages=max_pages)
+    return extract_text(pdf_path=source, max_pages=max_pages)
+
+
+def _init_worker():
+    # 预先初始化MuPDF，避免第一个任务承担初始化开销
+    fitz.open().close()
+
+
+def _ping():
+    return os.getpid()
+
+
+class PdfExtractionEngine:
+    """
+    基于进程池的PDF文本提取引擎，绕开GIL让提取在多核上并行
+    """
+    def __init__(self, max_workers=None, chunksize=4):
+        """
+        参数:
+            max_workers: 工作进程数，为None时使用CPU核数
+            chunksize: 批量提取时每次提交给一个进程的任务数
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """启动进程池并预热所有工作进程"""
+        with self.lock:
+            if self.executor is not None:
+                return
+            # 主进程中已有其他线程（Streamlit、下载和模型请求的线程池），fork可能继承被占用的锁而死锁，
+            # 使用forkserver（Windows上为spawn）启动工作进程
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                initializer=_init_worker)
+            # 每个进程至少执行一次任务，保证进程都已启动
+            futures = [self.executor.submit(_ping) for _ in range(self.max_workers)]
+            pids = {f.result() for f in futures}
+            logging.info(f"PDF提取进程池已启动，{len(pids)}个工作进程")
+
+    async def start_async(self):
+        """在线程中启动进程池，预热等待不阻塞事件循环"""
+        if self.executor is None:
+            await asyncio.to_thread(self.start)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+    def extract_pdf_content(self, pdf_path=None, stream=None, max_pages=1):
+        """与arxiv_pdf.extract_pdf_content相同的接口，在工作进程中提取"""
+        self.start()
+        source = stream if stream is not None else pdf_path
+        return self.executor.submit(_extract_task, (source, max_pages)).result()
+
+    async def extract_pdf_content_async(self, pdf_path=None, stream=None, max_pages=1):
+        await self.start_async()
+        source = stream if stream is not None else pdf_path
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _extract_task, (source, max_pages))
+
+    async def extract_first_page_async(self, pdf_path=None, stream=None):
+        """异步提取第一页全文和作者信息块"""
+        await self.start_async()
+        source = stream if stream is not None else pdf_path
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _first_page_task, source)
+
+    def extract_sections(self, pdf_path=None, stream=None, max_pages=5):
+        """在工作进程中按章节切分PDF文本，返回[(标题, 正文), ...]"""
+        self.start()
+        source = stream if stream is not None else pdf_path
+        return self.executor.submit(_sections_task, (source, max_pages)).result()
+
+    def extract_many(self, sources, max_pages=1):
+        """
+        批量提取PDF文本
+
+        参数:
+            sources: PDF文件路径或字节内容的列表
+            max_pages: 每个PDF提取的最大页数
+
+        返回:
+            与sources顺序一致的文本列表
+        """
+        self.start()
+        tasks = [(source, max_pages) for source in sources]
+        return list(self.executor.map(_extract_task, tasks, chunksize=self.chunksize))
+
+    async def extract_many_async(self, sources, max_pages=1):
+        return await asyncio.to_thread(self.extract_many, sources, max_pages)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """返回进程内共享的PDF提取引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PdfExtractionEngine()
+            atexit.register(_engine.shutdown)
+        return _engine
@@ -0,0 +1,331 @@
+import os
+import time
+import asyncio
+import random
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+import psutil
+
+DEFAULT_SCHEDULER_DB_PATH = "scheduler.db"
+
+# 优先级：数值越小越优先；界面上的交互请求优先于后台流水线
+PRIORITIES = {"interactive": 0, "background": 1}
+
+# 各类资源在所有进程间共享的并发上限；reserved为只留给交互请求的槽位，
+# 后台流水线占满其余槽位时，用户的请求仍然可以立即执行
+RESOURCE_LIMITS = {
+    "llm": {"capacity": 16, "reserved": 4},
+    "download": {"capacity": 6, "reserved": 2},
+}
+
+# 共享配额（每分钟请求数、token数）中只留给交互请求的比例，后台流水线最多用到其余部分
+QUOTA_RESERVED_SHARE = 0.25
+
+
+def get_process_priority():
+    """当前进程的优先级名称，由PAPER_PRIORITY环境变量决定，默认为交互优先级"""
+    priority = os.environ.get("PAPER_PRIORITY", "interactive")
+    return priority if priority in PRIORITIES else "interactive"
+
+
+def set_process_priority(priority):
+    """
+    设置当前进程（及其启动的子进程）的优先级
+
+    参数:
+        priority: "interactive" 或 "background"
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"未知的优先级: {priority}")
+    os.environ["PAPER_PRIORITY"] = priority
+
+
+class PriorityScheduler:
+    """
+    跨进程的优先级调度器：各进程通过同一个SQLite文件登记等待和占用的槽位，
+    同一资源上按（优先级、登记顺序）放行，交互请求可以越过排队中的后台请求；
+    已经开始执行的后台请求不会被打断
+    """
+    shared = True
+
+    def __init__(self, db_path=DEFAULT_SCHEDULER_DB_PATH, limits=None, poll_interval=0.05,
+                 max_poll_interval=0.5, lease_timeout=900.0):
+        """
+        参数:
+            db_path: 协调用的SQLite数据库文件路径
+            limits: 资源名称到{"capacity", "reserved"}的字典，为None时使用RESOURCE_LIMITS
+            poll_interval: 等待槽位时的初始轮询间隔（秒）
+            max_poll_interval: 轮询间隔上限（秒）
+            lease_timeout: 登记记录超过该时间未更新即视为失效（秒），用于清理异常退出的进程
+        """
+        self.db_path = db_path
+        self.limits = limits or RESOURCE_LIMITS
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.lease_timeout = lease_timeout
+        self.pid = os.getpid()
+        self.last_cleanup = 0.0
+
+        self.stats_lock = threading.Lock()
+        self.waits = {}
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, resource TEXT, priority INTEGER, pid INTEGER, "
+                "granted INTEGER DEFAULT 0, updated_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_leases_resource ON leases (resource, granted)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quotas (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _cleanup(self, conn):
+        """删除已退出进程或长时间未更新的登记记录"""
+        now = time.time()
+        if now - self.last_cleanup < 5:
+            return
+        self.last_cleanup = now
+        conn.execute("DELETE FROM leases WHERE updated_at < ?", (now - self.lease_timeout,))
+        pids = [row[0] for row in conn.execute("SELECT DISTINCT pid FROM leases WHERE pid != ?", (self.pid,))]
+        dead = [pid for pid in pids if not psutil.pid_exists(pid)]
+        if dead:
+            conn.executemany("DELETE FROM leases WHERE pid = ?", [(pid,) for pid in dead])
+            logging.info(f"优先级调度器清理了已退出进程的登记记录: {dead}")
+
+    def _register(self, resource, level):
+        with self._connect() as conn:
+            return conn.execute(
+                "INSERT INTO leases (resource, priority, pid, granted, updated_at) VALUES (?, ?, ?, 0, ?)",
+                (resource, level, self.pid, time.time())
+            ).lastrowid
+
+    def _try_grant(self, lease_id, resource, level):
+        """排在前面的请求都已放行且有空闲槽位时占用槽位，返回是否成功"""
+        limit = self.limits.get(resource, {"capacity": 1, "reserved": 0})
+        capacity = limit["capacity"]
+        if level > PRIORITIES["interactive"]:
+            capacity = max(1, capacity - limit.get("reserved", 0))
+        with self._connect() as conn:
+            # 立即加写锁，保证检查和占用在所有进程间是原子的
+            conn.execute("BEGIN IMMEDIATE")
+            self._cleanup(conn)
+            running = conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE resource = ? AND granted = 1", (resource,)
+            ).fetchone()[0]
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE resource = ? AND granted = 0 "
+                "AND (priority < ? OR (priority = ? AND id < ?))",
+                (resource, level, level, lease_id)
+            ).fetchone()[0]
+            granted = ahead == 0 and running < capacity
+            conn.execute(
+                "UPDATE leases SET granted = ?, updated_at = ? WHERE id = ?",
+                (int(granted), time.time(), lease_id)
+            )
+            return granted
+
+    def release(self, lease_id):
+        if lease_id is None:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+        except sqlite3.Error as e:
+            logging.warning(f"优先级调度器释放槽位失败: {str(e)}")
+
+    def _record_wait(self, priority, seconds):
+        with self.stats_lock:
+            count, total = self.waits.get(priority, (0, 0.0))
+            self.waits[priority] = (count + 1, total + seconds)
+
+    def acquire(self, resource, priority=None):
+        """
+        等待并占用resource的一个槽位
+
+        参数:
+            resource: 资源名称，例如 "llm"、"download"
+            priority: 优先级名称，为None时使用当前进程的优先级
+
+        返回:
+            登记ID，用于release；协调文件不可用时返回None（不限制并发）
+        """
+        priority = priority or get_process_priority()
+        level = PRIORITIES[priority]
+        start = time.monotonic()
+        try:
+            lease_id = self._register(resource, level)
+        except sqlite3.Error as e:
+            logging.warning(f"优先级调度器不可用，直接执行: {str(e)}")
+            return None
+        interval = self.poll_interval
+        try:
+            while not self._try_grant(lease_id, resource, level):
+                time.sleep(interval * random.uniform(0.5, 1.0))
+                interval = min(self.max_poll_interval, interval * 1.5)
+        except sqlite3.Error as e:
+            logging.warning(f"优先级调度器不可用，直接执行: {str(e)}")
+            self.release(lease_id)
+            return None
+        except BaseException:
+            self.release(lease_id)
+            raise
+        self._record_wait(priority, time.monotonic() - start)
+        return lease_id
+
+    async def acquire_async(self, resource, priority=None):
+        """
+        acquire的异步版本：SQLite操作（可能等待写锁）在线程中执行，
+        等待期间不阻塞事件循环
+        """
+        priority = priority or get_process_priority()
+        level = PRIORITIES[priority]
+        start = time.monotonic()
+        try:
+            lease_id = await asyncio.to_thread(self._register, resource, level)
+        except sqlite3.Error as e:
+            logging.warning(f"优先级调度器不可用，直接执行: {str(e)}")
+            return None
+        interval = self.poll_interval
+        try:
+            while not await asyncio.to_thread(self._try_grant, lease_id, resource, level):
+                await asyncio.sleep(interval * random.uniform(0.5, 1.0))
+                interval = min(self.max_poll_interval, interval * 1.5)
+        except sqlite3.Error as e:
+            logging.warning(f"优先级调度器不可用，直接执行: {str(e)}")
+            await asyncio.to_thread(self.release, lease_id)
+            return None
+        except BaseException:
+            # 任务被取消时也要释放登记，这里不能再等待
+            self.release(lease_id)
+            raise
+        self._record_wait(priority, time.monotonic() - start)
+        return lease_id
+
+    @contextmanager
+    def slot(self, resource, priority=None):
+        """占用resource的一个槽位，退出时释放"""
+        lease_id = self.acquire(resource, priority)
+        try:
+            yield
+        finally:
+            self.release(lease_id)
+
+    @asynccontextmanager
+    async def slot_async(self, resource, priority=None):
+        lease_id = await self.acquire_async(resource, priority)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.release, lease_id)
+
+    def _refilled_quota(self, conn, name, per_minute, now):
+        row = conn.execute("SELECT tokens, updated_at FROM quotas WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return float(per_minute)
+        tokens, updated_at = row
+        return min(float(per_minute), tokens + max(0.0, now - updated_at) * per_minute / 60.0)
+
+    def take_quota(self, name, amount, per_minute, priority=None):
+        """
+        从所有进程共享的每分钟配额桶中扣除amount
+
+        参数:
+            name: 配额名称，例如 "llm_requests"
+            amount: 扣除的数量
+            per_minute: 每分钟的配额，同时也是桶的容量
+            priority: 优先级名称，为None时使用当前进程的优先级；后台请求不能用掉保留给交互请求的部分
+
+        返回:
+            0表示扣除成功，否则为需要等待的秒数（未扣除）
+        """
+        priority = priority or get_process_priority()
+        floor = per_minute * QUOTA_RESERVED_SHARE if PRIORITIES[priority] > PRIORITIES["interactive"] else 0.0
+        amount = min(float(amount), per_minute - floor)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens = self._refilled_quota(conn, name, per_minute, now)
+            granted = tokens - amount >= floor
+            if granted:
+                tokens -= amount
+            conn.execute(
+                "INSERT OR REPLACE INTO quotas (name, tokens, updated_at) VALUES (?, ?, ?)", (name, tokens, now)
+            )
+        return 0.0 if granted else (amount + floor - tokens) * 60.0 / per_minute
+
+    def adjust_quota(self, name, amount, per_minute):
+        """按实际用量修正共享配额：amount为正时多扣，为负时退还"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens = min(float(per_minute), self._refilled_quota(conn, name, per_minute, now) - amount)
+            conn.execute(
+                "INSERT OR REPLACE INTO quotas (name, tokens, updated_at) VALUES (?, ?, ?)", (name, tokens, now)
+            )
+
+    def log_stats(self):
+        with self.stats_lock:
+            waits = dict(self.waits)
+        for priority, (count, total) in waits.items():
+            logging.info(f"优先级调度统计({priority}): 获取槽位{count}次，平均等待{total / count:.2f}秒")
+
+
+class NullScheduler:
+    """
+    协调文件无法创建时（例如只读目录）使用的调度器：不登记也不限制并发，
+    共享配额由调用方退回进程内的令牌桶
+    """
+    shared = False
+
+    def acquire(self, resource, priority=None):
+        return None
+
+    async def acquire_async(self, resource, priority=None):
+        return None
+
+    def release(self, lease_id):
+        pass
+
+    @contextmanager
+    def slot(self, resource, priority=None):
+        yield
+
+    @asynccontextmanager
+    async def slot_async(self, resource, priority=None):
+        yield
+
+    def log_stats(self):
+        pass
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    返回进程内共享的优先级调度器，
+    可以用PAPER_SCHEDULER_DB环境变量指定协调文件，界面和后台流水线需使用同一个文件
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            db_path = os.environ.get("PAPER_SCHEDULER_DB", DEFAULT_SCHEDULER_DB_PATH)
+            try:
+                _scheduler = PriorityScheduler(db_path)
+            except sqlite3.Error as e:
+                logging.warning(f"无法打开优先级调度器的协调文件{db_path}，不做跨进程调度: {str(e)}")
+                _scheduler = NullScheduler()
+        return _scheduler
@@ -0,0 +1,124 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import unicodedata
+from contextlib import contextmanager
+
+DEFAULT_QUERY_CACHE_PATH = "query_cache.db"
+
+
+def normalize_query(query):
+    """规范化查询文本：统一全角半角和大小写，合并空白，去掉首尾标点"""
+    text = unicodedata.normalize("NFKC", str(query)).lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" \t\"'“”‘’.,;:!?。，；：！？")
+
+
+def corpus_version(paper_ids, params=""):
+    """根据论文ID集合（与顺序无关）和检索参数计算语料版本"""
+    payload = json.dumps(sorted(str(paper_id) for paper_id in paper_ids), ensure_ascii=False) + str(params)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class QueryResultCache:
+    """
+    关键词筛选结果的跨会话缓存：
+    按（模型、规范化查询）保存每篇论文的判断结果，语料有重叠时复用；
+    按（模型、规范化查询、语料版本）保存完整结果，重复查询直接返回
+    """
+    def __init__(self, db_path=DEFAULT_QUERY_CACHE_PATH, ttl_seconds=30 * 24 * 3600):
+        """
+        参数:
+            db_path: SQLite数据库文件路径
+            ttl_seconds: 缓存条目的有效期（秒）
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "model TEXT, query TEXT, paper_id TEXT, matched INTEGER, created_at REAL, "
+                "PRIMARY KEY (model, query, paper_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "model TEXT, query TEXT, corpus TEXT, paper_ids TEXT, created_at REAL, "
+                "PRIMARY KEY (model, query, corpus))"
+            )
+        # 每次打开时清理过期条目，避免两张表无限增长
+        self.evict()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_result(self, model, query, corpus):
+        """返回同一语料上同一查询的匹配论文ID列表，不存在或已过期时返回None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT paper_ids, created_at FROM results WHERE model = ? AND query = ? AND corpus = ?",
+                (model, query, corpus)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        return json.loads(row[0])
+
+    def put_result(self, model, query, corpus, paper_ids):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (model, query, corpus, paper_ids, created_at) VALUES (?, ?, ?, ?, ?)",
+                (model, query, corpus, json.dumps([str(paper_id) for paper_id in paper_ids]), time.time())
+            )
+
+    def get_verdicts(self, model, query, paper_ids):
+        """
+        返回:
+            论文ID到是否匹配的字典，只包含有未过期判断结果的论文
+        """
+        paper_ids = [str(paper_id) for paper_id in paper_ids]
+        cutoff = time.time() - self.ttl_seconds
+        verdicts = {}
+        with self._connect() as conn:
+            for start in range(0, len(paper_ids), 500):
+                batch = paper_ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                for paper_id, matched in conn.execute(
+                    f"SELECT paper_id, matched FROM verdicts WHERE model = ? AND query = ? "
+                    f"AND created_at >= ? AND paper_id IN ({placeholders})",
+                    [model, query, cutoff] + batch
+                ):
+                    verdicts[paper_id] = bool(matched)
+        return verdicts
+
+    def put_verdicts(self, model, query, verdicts):
+        """
+        参数:
+            verdicts: 论文ID到是否匹配的字典
+        """
+        if not verdicts:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO verdicts (model, query, paper_id, matched, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(model, query, str(paper_id), int(bool(matched)), now) for paper_id, matched in verdicts.items()]
+            )
+
+    def evict(self):
+        """删除过期条目"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._connect() as conn:
+            removed = conn.execute("DELETE FROM verdicts WHERE created_at < ?", (cutoff,)).rowcount
+            removed += conn.execute("DELETE FROM results WHERE created_at < ?", (cutoff,)).rowcount
+        if removed:
+            logging.info(f"查询结果缓存淘汰了{removed}个条目")
+        return removed
@@ -0,0 +1,81 @@
+import re
+import logging
+from tokenization import count_tokens, truncate_tokens
+
+# 章节类别及其在token预算中的占比，按优先级从高到低排列；未列出的类别（相关工作、参考文献等）不发送
+# 标题之前的内容（preface）包括题目和作者，没有单独的Abstract标题时也包括摘要
+SECTION_SHARES = [
+    ("abstract", 0.15),
+    ("preface", 0.15),
+    ("introduction", 0.2),
+    ("method", 0.25),
+    ("results", 0.15),
+    ("conclusion", 0.1),
+]
+
+SECTION_PATTERNS = [
+    ("abstract", re.compile(r"abstract", re.IGNORECASE)),
+    ("introduction", re.compile(r"introduction|overview|motivation", re.IGNORECASE)),
+    ("skip", re.compile(r"related work|background|preliminar|references|bibliography|acknowledg|appendix", re.IGNORECASE)),
+    ("conclusion", re.compile(r"conclusion|summary|discussion|limitation|future work", re.IGNORECASE)),
+    ("results", re.compile(r"experiment|result|evaluation|benchmark|ablation|analysis", re.IGNORECASE)),
+]
+
+
+def section_kind(heading):
+    """根据标题判断章节类别，其余带标题的章节视为方法部分"""
+    if not heading:
+        return "preface"
+    for kind, pattern in SECTION_PATTERNS:
+        if pattern.search(heading):
+            return kind
+    return "method"
+
+
+def build_summary_input(sections, token_budget=3000, model="gpt-4o"):
+    """
+    从按章节切分的论文文本中挑选摘要、引言、方法、结果和结论，裁剪到token预算以内
+
+    参数:
+        sections: [(标题, 正文), ...]，见pdf_extraction_engine.extract_sections
+        token_budget: 输入文本的token上限
+        model: 用于选择分词器的模型名称
+
+    返回:
+        按原文顺序拼接的文本
+    """
+    if not sections:
+        return ""
+    kinds = [section_kind(heading) for heading, _ in sections]
+    if set(kinds) <= {"preface"}:
+        # 没有识别出章节标题，直接截断全文
+        return truncate_tokens("\n".join(body for _, body in sections), token_budget, model)
+
+    tokens = [count_tokens(f"{heading}\n{body}", model) for heading, body in sections]
+    allowed = [0] * len(sections)
+
+    # 第一轮：每个类别按占比分配预算，类别内平均分给各个章节
+    shares = dict(SECTION_SHARES)
+    for kind, share in shares.items():
+        members = [i for i, k in enumerate(kinds) if k == kind]
+        for i in members:
+            allowed[i] = min(tokens[i], int(token_budget * share / len(members)))
+
+    # 第二轮：剩余预算按类别优先级补给被截断的章节
+    remaining = token_budget - sum(allowed)
+    for kind, _ in SECTION_SHARES:
+        for i, k in enumerate(kinds):
+            if k == kind and remaining > 0 and allowed[i] < tokens[i]:
+                extra = min(tokens[i] - allowed[i], remaining)
+                allowed[i] += extra
+                remaining -= extra
+
+    parts = []
+    for (heading, body), limit, total in zip(sections, allowed, tokens):
+        if limit <= 0:
+            continue
+        text = f"{heading}\n{body}" if heading else body
+        parts.append(text if limit >= total else truncate_tokens(text, limit, model))
+    result = "\n\n".join(parts)
+    logging.info(f"摘要输入: 原文{sum(tokens)}个token，裁剪后约{sum(allowed)}个token")
+    return result
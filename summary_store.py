@@ -0,0 +1,94 @@
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from fetch_watermark import base_paper_id
+
+DEFAULT_SUMMARY_DB_PATH = "summaries.db"
+
+
+def split_version(paper_id):
+    """将论文ID拆分为不含版本号的ID和版本号，例如 2503.16203v2 -> ("2503.16203", "v2")"""
+    paper_id = str(paper_id).strip()
+    match = re.search(r"v\d+$", paper_id)
+    return base_paper_id(paper_id), match.group(0) if match else ""
+
+
+def prompt_hash(prompt):
+    """系统提示的哈希，提示修改后旧的摘要自动失效"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def input_hash(text):
+    """发送给模型的论文内容的哈希，重新提取的内容不同时旧的摘要失效"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class SummaryStore:
+    """
+    论文摘要的持久化存储，按（论文ID、版本号、模型、系统提示哈希）索引，并记录论文内容的哈希，
+    定时流水线和界面上的自定义快报共用，同一篇论文的摘要只需要生成一次
+    """
+    def __init__(self, db_path=DEFAULT_SUMMARY_DB_PATH):
+        """
+        参数:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "paper_id TEXT, version TEXT, model TEXT, prompt_hash TEXT, summary TEXT, created_at REAL, "
+                "PRIMARY KEY (paper_id, version, model, prompt_hash))"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(summaries)")}
+            if "input_hash" not in columns:
+                conn.execute("ALTER TABLE summaries ADD COLUMN input_hash TEXT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, paper_id, model, prompt, text):
+        """返回由相同论文内容生成的已保存摘要，不存在或论文内容不同时返回None"""
+        base_id, version = split_version(paper_id)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT summary FROM summaries WHERE paper_id = ? AND version = ? AND model = ? "
+                "AND prompt_hash = ? AND input_hash = ?",
+                (base_id, version, model, prompt_hash(prompt), input_hash(text))
+            ).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if row is None else row[0]
+
+    def put(self, paper_id, model, prompt, text, summary):
+        base_id, version = split_version(paper_id)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries "
+                "(paper_id, version, model, prompt_hash, input_hash, summary, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (base_id, version, model, prompt_hash(prompt), input_hash(text), summary, time.time())
+            )
+
+    def log_stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            rate = self.hits / total if total else 0.0
+            logging.info(f"摘要存储统计: 命中{self.hits}，未命中{self.misses}，命中率{rate:.1%}")
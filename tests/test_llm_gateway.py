@@ -0,0 +1,178 @@
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import llm_gateway
+from llm_gateway import LLMGateway, CircuitBreaker, CircuitOpenError, RateBucket
+from priority_scheduler import PriorityScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeCompletions:
+    """按顺序返回预设的结果，结果是异常时抛出"""
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_response(content="ok", total_tokens=None):
+    usage = SimpleNamespace(total_tokens=total_tokens) if total_tokens is not None else None
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def make_error(error_class, status_code, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return error_class("error", response=response, body=None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(llm_gateway.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    scheduler = PriorityScheduler(str(tmp_path / "scheduler.db"))
+    monkeypatch.setattr(llm_gateway, "get_scheduler", lambda: scheduler)
+    return scheduler
+
+
+@pytest.fixture
+def make_gateway(scheduler, clock):
+
+    def make(outcomes, **kwargs):
+        gateway = LLMGateway(api_key="test", **kwargs)
+        gateway.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(outcomes)))
+        return gateway
+    return make
+
+
+def test_rate_limit_waits_for_retry_after_ms(make_gateway, clock):
+    error = make_error(openai.RateLimitError, 429, {"retry-after-ms": "250"})
+    gateway = make_gateway([error, make_response()])
+
+    response = gateway.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+
+    assert response.choices[0].message.content == "ok"
+    assert clock.sleeps == [0.25]
+    assert gateway.stats()["retries"] == 1
+    # 限流不计入熔断
+    assert gateway.breaker.failures == 0
+
+
+def test_non_retryable_error_does_not_trip_breaker(make_gateway):
+    error = make_error(openai.BadRequestError, 400)
+    gateway = make_gateway([error, make_response()], failure_threshold=1)
+
+    with pytest.raises(openai.BadRequestError):
+        gateway.chat.completions.create(model="gpt-4o", messages=[])
+    assert gateway.breaker.opened_at is None
+    assert gateway.client.chat.completions.calls == 1
+
+    assert gateway.chat.completions.create(model="gpt-4o", messages=[]).choices[0].message.content == "ok"
+
+
+def test_half_open_allows_single_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.on_failure()
+    breaker.before_call()
+    breaker.on_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 11
+    breaker.before_call()
+    # 试探请求进行中，其他请求仍被拒绝
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # 试探失败后重新打开
+    breaker.on_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 11
+    breaker.before_call()
+    breaker.on_success()
+    breaker.before_call()
+    breaker.before_call()
+    assert breaker.failures == 0
+
+
+def test_adjust_refunds_unused_tokens(clock):
+    bucket = RateBucket(600)
+    bucket.acquire(500)
+    assert bucket.tokens == pytest.approx(100)
+
+    bucket.adjust(-300)
+    assert bucket.tokens == pytest.approx(400)
+    # 退还不会超过桶容量
+    bucket.adjust(-1000)
+    assert bucket.tokens == pytest.approx(600)
+
+
+def remaining_quota(scheduler, name):
+    with scheduler._connect() as conn:
+        return conn.execute("SELECT tokens FROM quotas WHERE name = ?", (name,)).fetchone()[0]
+
+
+def test_gateway_corrects_token_estimate_with_usage(make_gateway, scheduler):
+    gateway = make_gateway([make_response(total_tokens=100)], tpm=10000)
+    request = {"model": "gpt-4o", "messages": [{"role": "user", "content": "hello"}], "max_tokens": 2000}
+    estimated = llm_gateway.estimate_request_tokens(request)
+
+    gateway.chat.completions.create(**request)
+
+    assert estimated > 100
+    # 配额桶按秒补充，允许测试运行期间的少量补充
+    assert remaining_quota(scheduler, "llm_tokens") == pytest.approx(10000 - 100, abs=5)
+
+
+def test_background_cannot_use_reserved_quota(scheduler):
+    # 后台请求最多用到配额的75%，剩余部分留给交互请求
+    assert scheduler.take_quota("llm_requests", 70, 100, priority="background") == 0
+    assert scheduler.take_quota("llm_requests", 10, 100, priority="background") > 0
+    assert scheduler.take_quota("llm_requests", 10, 100, priority="interactive") == 0
+    assert remaining_quota(scheduler, "llm_requests") == pytest.approx(20, abs=1)
+
+
+def test_shared_bucket_falls_back_without_coordination_file(monkeypatch, clock):
+    import priority_scheduler
+    monkeypatch.setattr(priority_scheduler, "_scheduler", None)
+    monkeypatch.setenv("PAPER_SCHEDULER_DB", "/nonexistent/dir/scheduler.db")
+    scheduler = priority_scheduler.get_scheduler()
+    monkeypatch.setattr(llm_gateway, "get_scheduler", lambda: scheduler)
+
+    assert not scheduler.shared
+    with scheduler.slot("llm"):
+        pass
+    bucket = llm_gateway.SharedRateBucket("llm_tokens", 600)
+    bucket.acquire(100)
+    bucket.adjust(-50)
+    assert bucket.fallback.tokens == pytest.approx(550)